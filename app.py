@@ -1,26 +1,168 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, g, has_request_context, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import and_, bindparam, case, column, create_engine, event, or_, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from apscheduler.schedulers.background import BackgroundScheduler
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
+import atexit
+import base64
+import copy
+import csv
+import glob
 import hashlib
+import hmac
+import io
+import json
+import logging
+import logging.handlers
+import math
 import os
+import psutil
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
 
 app = Flask(__name__)
+
+# Структурированные логи: JSON-строка на запись, вывод в фоновом потоке
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+# Доля проверок лицензий, попадающих в лог (остальные учитываются только в метриках)
+LOG_VALIDATION_SAMPLE_RATE = float(os.environ.get('LOG_VALIDATION_SAMPLE_RATE', 0.01))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет идентификатор текущего HTTP-запроса (выполняется в потоке запроса)"""
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+        return True
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Потоки запросов только кладут запись в очередь, запись в stdout делает QueueListener.
+    Поток слушателя не переживает fork, поэтому он запускается заново в каждом процессе."""
+    def __init__(self, handler):
+        super().__init__(queue.SimpleQueue())
+        self.handler = handler
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+    
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        super().enqueue(record)
+    
+    def prepare(self, record):
+        # Сохраняем поля записи для JSON, сообщение и исключение форматируем здесь:
+        # аргументы могут измениться, пока запись ждет в очереди
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def _start_listener(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, self.handler)
+            self._listener.start()
+            self._pid = os.getpid()
+    
+    def stop(self):
+        """Дописывает оставшиеся в очереди записи"""
+        if self._listener and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+_log_output = logging.StreamHandler(sys.stdout)
+_log_output.setFormatter(
+    JsonFormatter() if LOG_FORMAT == 'json'
+    else logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(message)s %(fields)s', defaults={'request_id': '-', 'fields': ''})
+)
+log_handler = AsyncLogHandler(_log_output)
+log_handler.addFilter(RequestIdFilter())
+
+logger = logging.getLogger('license_server')
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+logger.propagate = False
+atexit.register(log_handler.stop)
+
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-me')
 
-database_url = os.environ.get('DATABASE_URL')
+# Число доверенных прокси перед приложением (на Heroku - 1), чтобы remote_addr был адресом клиента
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+def normalize_database_url(url):
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def engine_options(url, prefix):
+    """Параметры движка; размеры пула задаются отдельно для каждой базы (DB_*, DB_READ_*)"""
+    options = {
+        'pool_recycle': 300,
+        'pool_pre_ping': True
+    }
+    if not url.startswith('sqlite'):
+        # Пул соединений по числу потоков воркера gunicorn (см. gunicorn.conf.py)
+        options.update({
+            'pool_size': int(os.environ.get(f'{prefix}_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 8))),
+            'max_overflow': int(os.environ.get(f'{prefix}_MAX_OVERFLOW', 4)),
+            'pool_timeout': int(os.environ.get(f'{prefix}_POOL_TIMEOUT', 10))
+        })
+    return options
+
+database_url = normalize_database_url(os.environ.get('DATABASE_URL'))
 
 if database_url:
-    if database_url.startswith('postgres://'):
-        database_url = database_url.replace('postgres://', 'postgresql://', 1)
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///licenses.db'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_recycle': 300,
-    'pool_pre_ping': True
-}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], 'DB')
+
+# Необязательная реплика для чтения в клиентских проверках
+DATABASE_READ_URL = normalize_database_url(os.environ.get('DATABASE_READ_URL'))
+REPLICA_RETRY_INTERVAL = int(os.environ.get('REPLICA_RETRY_INTERVAL', 30))
 
 db = SQLAlchemy(app)
 
@@ -38,6 +180,15 @@ class License(db.Model):
     # Добавляем поле для отслеживания продлений
     original_expiry_date = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        # Индекс для фоновой деактивации истекших лицензий
+        db.Index('ix_license_active_expiry', 'is_active', 'expiry_date'),
+        # Индексы для поиска по префиксу в списке лицензий админки
+        db.Index('ix_license_key_prefix', 'key', postgresql_ops={'key': 'varchar_pattern_ops'}),
+        db.Index('ix_license_name_prefix', 'name', postgresql_ops={'name': 'varchar_pattern_ops'}),
+        db.Index('ix_license_hwid_prefix', 'hwid', postgresql_ops={'hwid': 'varchar_pattern_ops'}),
+    )
+
 class ActivationRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(50), nullable=False)
@@ -46,88 +197,931 @@ class ActivationRequest(db.Model):
     user_agent = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='pending')
+    # Повторные запросы с того же устройства не создают новых строк
+    attempts = db.Column(db.Integer, default=1, nullable=False)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('uq_activation_request_pending', 'key', 'hwid', unique=True,
+                 postgresql_where=db.text("status = 'pending'"),
+                 sqlite_where=db.text("status = 'pending'")),
+        # Список ожидающих запросов и очистка обработанных
+        db.Index('ix_activation_request_status_last_seen', 'status', 'last_seen'),
+        db.Index('ix_activation_request_status_key', 'status', 'key'),
+    )
 
 class AdminUser(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
 
-# Создаем таблицы при запуске
-with app.app_context():
+class TokenRevocation(db.Model):
+    """Отзыв офлайн-токенов: недействительны токены ключа, выданные до revoked_at"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), nullable=False)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_token_revocation_key_revoked', 'key', 'revoked_at'),
+    )
+
+class LicenseActivity(db.Model):
+    """Сводка событий лицензии по часам и по дням. Сырые события не храним:
+    объем ограничен числом ключей, устройств и периодов, а не числом проверок."""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), nullable=False)
+    period = db.Column(db.String(4), nullable=False)  # hour / day
+    bucket = db.Column(db.DateTime, nullable=False)  # начало часа или дня (UTC)
+    event = db.Column(db.String(20), nullable=False)  # validate / activate / rejected
+    hwid = db.Column(db.String(255), nullable=False, default='')  # '' - устройство не передано
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('uq_license_activity', 'key', 'period', 'bucket', 'event', 'hwid', unique=True),
+        db.Index('ix_license_activity_period_bucket', 'period', 'bucket'),
+    )
+
+class SchemaVersion(db.Model):
+    """Примененные миграции схемы"""
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Миграции схемы. Применяются один раз вне воркеров:
+# flask --app app db-upgrade (или автоматически из gunicorn.conf.py)
+# Все миграции выполняются в одной транзакции на соединении сессии
+def get_column_names(table_name):
+    return [col['name'] for col in db.inspect(db.session.connection()).get_columns(table_name)]
+
+def add_column(table_name, column_name, column_type):
+    type_sql = column_type.compile(dialect=db.engine.dialect)
+    db.session.execute(db.text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {type_sql}'))
+
+def migrate_initial_schema():
+    db.metadata.create_all(bind=db.session.connection())
+
+def migrate_original_expiry_date():
+    if 'original_expiry_date' not in get_column_names('license'):
+        add_column('license', 'original_expiry_date', db.DateTime())
+
+def migrate_activation_request_attempts():
+    if 'attempts' not in get_column_names('activation_request'):
+        db.session.execute(db.text('ALTER TABLE activation_request ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1'))
+        add_column('activation_request', 'last_seen', db.DateTime())
+        db.session.execute(db.text('UPDATE activation_request SET last_seen = created_at'))
+    
+    # Перед созданием уникального индекса схлопываем дубли ожидающих запросов
+    db.session.execute(db.text(
+        "DELETE FROM activation_request WHERE status = 'pending' AND id NOT IN ("
+        "SELECT MAX(id) FROM activation_request WHERE status = 'pending' GROUP BY key, hwid)"
+    ))
+
+def migrate_indexes():
+    # create_all не добавляет индексы в уже существующие таблицы;
+    # таблицы, появившиеся в следующих миграциях, создаются сразу с индексами
+    inspector = db.inspect(db.session.connection())
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        for index in table.indexes:
+            index.create(bind=db.session.connection(), checkfirst=True)
+
+def migrate_license_activity():
+    LicenseActivity.__table__.create(bind=db.session.connection(), checkfirst=True)
+
+MIGRATIONS = [
+    (1, 'initial schema', migrate_initial_schema),
+    (2, 'license.original_expiry_date', migrate_original_expiry_date),
+    (3, 'activation_request attempts and last_seen', migrate_activation_request_attempts),
+    (4, 'indexes for expiry, search, activation requests and revocations', migrate_indexes),
+    (5, 'license_activity rollups', migrate_license_activity),
+]
+
+def upgrade_database():
+    """Применяет недостающие миграции, возвращает число примененных"""
     try:
-        db.create_all()
+        if db.engine.dialect.name == 'postgresql':
+            # Не даем двум процессам мигрировать одновременно (снимается при commit)
+            db.session.execute(db.text('SELECT pg_advisory_xact_lock(715517)'))
         
-        # Миграция для добавления нового поля
-        try:
-            # Проверяем существует ли поле original_expiry_date
-            inspector = db.inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('license')]
-            
-            if 'original_expiry_date' not in columns:
-                print("🔄 Adding original_expiry_date column to license table...")
-                db.session.execute('ALTER TABLE license ADD COLUMN original_expiry_date DATETIME')
-                db.session.commit()
-                print("✅ Column added successfully")
-        except Exception as e:
-            print(f"⚠️ Could not add column (might already exist): {e}")
-            db.session.rollback()
+        SchemaVersion.__table__.create(bind=db.session.connection(), checkfirst=True)
+        current = db.session.execute(db.select(db.func.max(SchemaVersion.version))).scalar() or 0
         
-        if not AdminUser.query.first():
-            default_password = os.environ.get('ADMIN_PASSWORD', 'Pfizer!Soft2025')
-            admin = AdminUser(
-                username='admin',
-                password_hash=hashlib.sha256(default_password.encode()).hexdigest()
-            )
-            db.session.add(admin)
-            db.session.commit()
-            print("✅ Default admin created: admin /", default_password)
-    except Exception as e:
-        print(f"❌ Database initialization error: {e}")
+        applied = 0
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info('Applying migration', extra={'fields': {'version': version, 'description': description}})
+            migrate()
+            db.session.add(SchemaVersion(version=version, description=description))
+            db.session.flush()
+            applied += 1
+        
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    logger.info('Database schema is up to date', extra={'fields': {'version': MIGRATIONS[-1][0], 'applied': applied}})
+    return applied
+
+def create_default_admin():
+    """Создает администратора по умолчанию, если его еще нет"""
+    if not AdminUser.query.first():
+        default_password = os.environ.get('ADMIN_PASSWORD', 'Pfizer!Soft2025')
+        admin = AdminUser(
+            username='admin',
+            password_hash=hashlib.sha256(default_password.encode()).hexdigest()
+        )
+        db.session.add(admin)
+        db.session.commit()
+        # Пароль в лог не пишем: он задается ADMIN_PASSWORD (или взят по умолчанию)
+        logger.warning('Default admin created', extra={'fields': {
+            'username': 'admin',
+            'password_source': 'ADMIN_PASSWORD' if os.environ.get('ADMIN_PASSWORD') else 'built-in default, set ADMIN_PASSWORD'
+        }})
+
+def init_db():
+    """Однократная подготовка базы: миграции и администратор по умолчанию.
+    При импорте модуля к базе не обращаемся - воркеры стартуют без запросов к ней."""
+    upgrade_database()
+    create_default_admin()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Применяет миграции и создает администратора по умолчанию"""
+    init_db()
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Применяет миграции схемы базы данных"""
+    upgrade_database()
 
 def check_all_licenses_expiry():
-    """Проверяет все лицензии на истечение срока"""
+    """Деактивирует все истекшие лицензии одним UPDATE"""
     try:
-        licenses = License.query.all()
+        started = time.perf_counter()
         now = datetime.utcnow()
-        expired_count = 0
+        expired_count = License.query.filter(
+            License.is_active.is_(True),
+            License.expiry_date < now
+        ).update({License.is_active: False}, synchronize_session=False)
+        db.session.commit()
         
-        for license in licenses:
-            if license.expiry_date and license.expiry_date < now and license.is_active:
-                license.is_active = False
-                expired_count += 1
-                print(f"⏰ License {license.key} expired and deactivated")
+        metrics.observe('expiry_sweep_duration_seconds', time.perf_counter() - started)
+        metrics.inc('expiry_sweep_rows_total', value=expired_count)
         
         if expired_count > 0:
-            db.session.commit()
-            print(f"✅ Deactivated {expired_count} expired licenses")
-        else:
-            print("✅ No expired licenses found")
+            logger.info('Deactivated expired licenses', extra={'fields': {'count': expired_count}})
             
         return expired_count
-    except Exception as e:
-        print(f"❌ Error checking licenses expiry: {e}")
+    except Exception:
+        logger.exception('Error checking licenses expiry')
         db.session.rollback()
         return 0
 
+def deactivate_expired_license(key):
+    """Деактивирует истекшую лицензию условным UPDATE на основной базе"""
+    try:
+        result = db.session.execute(
+            db.update(License)
+            .where(License.key == key, License.is_active.is_(True), License.expiry_date < datetime.utcnow())
+            .values(is_active=False)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logger.info('License automatically deactivated due to expiry', extra={'fields': {'key': key}})
+    except Exception:
+        logger.exception('Error deactivating expired license', extra={'fields': {'key': key}})
+        db.session.rollback()
+
 def is_license_expired(license_obj):
     """Проверяет истекла ли лицензия"""
-    if not license_obj.expiry_date:
+    if not license_obj.expiry_date or license_obj.expiry_date >= datetime.utcnow():
         return False
     
-    now = datetime.utcnow()
-    is_expired = license_obj.expiry_date < now
-    
     # Немедленно деактивируем если истекла
-    if is_expired and license_obj.is_active:
-        license_obj.is_active = False
+    if license_obj.is_active:
+        deactivate_expired_license(license_obj.key)
+    
+    return True
+
+def run_expiry_job():
+    """Фоновая задача планировщика: проверка истечения лицензий"""
+    with app.app_context():
+        check_all_licenses_expiry()
+        try:
+            prune_token_revocations()
+        except Exception:
+            logger.exception('Error pruning token revocations')
+            db.session.rollback()
+    
+    if isinstance(rate_limit_backend, SQLiteRateLimitBackend):
+        try:
+            rate_limit_backend.prune(max_age=3600)
+        except Exception:
+            logger.exception('Error pruning rate limit buckets')
+
+ACTIVATION_REQUEST_RETENTION_DAYS = int(os.environ.get('ACTIVATION_REQUEST_RETENTION_DAYS', 30))
+
+def prune_activation_requests():
+    """Удаляет обработанные запросы на активацию старше срока хранения"""
+    with app.app_context():
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=ACTIVATION_REQUEST_RETENTION_DAYS)
+            deleted = ActivationRequest.query.filter(
+                ActivationRequest.status != 'pending',
+                ActivationRequest.last_seen < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if deleted:
+                logger.info('Removed processed activation requests', extra={'fields': {'count': deleted}})
+            return deleted
+        except Exception:
+            logger.exception('Error pruning activation requests')
+            db.session.rollback()
+            return 0
+
+# Фоновый планировщик вместо проверки всех лицензий на каждом запросе
+EXPIRY_CHECK_INTERVAL = int(os.environ.get('EXPIRY_CHECK_INTERVAL', 60))
+
+scheduler = BackgroundScheduler(daemon=True)
+scheduler.add_job(run_expiry_job, 'interval', seconds=EXPIRY_CHECK_INTERVAL,
+                  id='expiry_check', max_instances=1, coalesce=True,
+                  next_run_time=datetime.now(), misfire_grace_time=None)
+
+class LicenseCache:
+    """LRU-кэш состояния лицензий (hwid, is_active, expiry_date) с TTL"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            state, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.misses += 1
+                return None
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return state
+    
+    def set(self, key, state):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (state, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+class HeartbeatBuffer:
+    """Буфер отметок last_validation для пакетной записи в базу"""
+    
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+    
+    def record(self, key, timestamp):
+        """Запоминает отметку, возвращает True если буфер пора сбросить"""
+        with self._lock:
+            self._pending[key] = timestamp
+            return len(self._pending) >= self.max_pending
+    
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+    
+    def flush(self):
+        """Записывает накопленные отметки одним UPDATE и одним commit"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        table = License.__table__
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                # UPDATE license SET ... FROM (VALUES ...) AS v(key, ts)
+                rows = values(
+                    column('key', db.String), column('ts', db.DateTime), name='v'
+                ).data(list(pending.items()))
+                db.session.execute(
+                    table.update()
+                    .where(table.c.key == rows.c.key)
+                    .values(last_validation=rows.c.ts)
+                )
+            else:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.key == bindparam('k'))
+                    .values(last_validation=bindparam('ts')),
+                    [{'k': key, 'ts': ts} for key, ts in pending.items()]
+                )
+            db.session.commit()
+            return len(pending)
+        except Exception:
+            logger.exception('Error flushing validation heartbeats', extra={'fields': {'pending': len(pending)}})
+            db.session.rollback()
+            # Возвращаем отметки в буфер, не затирая более свежие
+            with self._lock:
+                for key, ts in pending.items():
+                    self._pending.setdefault(key, ts)
+            return 0
+
+# Отложенная запись last_validation (в пределах одного процесса)
+heartbeat_buffer = HeartbeatBuffer(
+    max_pending=int(os.environ.get('HEARTBEAT_MAX_PENDING', 10000))
+)
+
+def flush_heartbeats():
+    """Сбрасывает буфер last_validation (планировщик и завершение воркера)"""
+    with app.app_context():
+        return heartbeat_buffer.flush()
+
+# Кэш проверок лицензий (в пределах одного процесса)
+license_cache = LicenseCache(
+    maxsize=int(os.environ.get('LICENSE_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('LICENSE_CACHE_TTL', 60))
+)
+
+HEARTBEAT_FLUSH_INTERVAL = int(os.environ.get('HEARTBEAT_FLUSH_INTERVAL', 30))
+
+scheduler.add_job(flush_heartbeats, 'interval', seconds=HEARTBEAT_FLUSH_INTERVAL,
+                  id='heartbeat_flush', max_instances=1, coalesce=True)
+atexit.register(flush_heartbeats)
+
+ACTIVITY_UPSERT_CHUNK = 500
+# Сколько раз событие возвращается в буфер после неудачной записи, прежде чем будет отброшено
+ACTIVITY_MAX_RETRIES = 3
+
+def normalize_activity_hwid(hwid):
+    """HWID приходит от клиента как есть: приводим к строке, допустимой для колонки String(255)"""
+    if hwid is None:
+        return ''
+    if not isinstance(hwid, str):
+        hwid = json.dumps(hwid, sort_keys=True, default=str)
+    return hwid.replace('\x00', '')[:255]
+
+class ActivityBuffer:
+    """Счетчики событий лицензий в памяти; в базу попадают пакетным upsert в сводки"""
+    
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._pending = {}
+        self._retries = {}
+        self._lock = threading.Lock()
+    
+    def record(self, key, event, hwid, timestamp):
+        """Учитывает событие, возвращает True если буфер пора сбросить"""
+        hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        entry = (key, event, normalize_activity_hwid(hwid), hour)
+        with self._lock:
+            self._pending[entry] = self._pending.get(entry, 0) + 1
+            return len(self._pending) >= self.max_pending
+    
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+    
+    @staticmethod
+    def _rows(entries):
+        """Строки часовой и дневной сводки для накопленных счетчиков"""
+        rows = {}
+        for (key, event, hwid, hour), count in entries:
+            day = hour.replace(hour=0)
+            for period, bucket in (('hour', hour), ('day', day)):
+                row_id = (key, period, bucket, event, hwid)
+                rows[row_id] = rows.get(row_id, 0) + count
+        return rows
+    
+    @staticmethod
+    def _upsert(rows):
+        table = LicenseActivity.__table__
+        if dialect_insert(table) is not None:
+            values_list = [
+                {'key': key, 'period': period, 'bucket': bucket, 'event': event, 'hwid': hwid, 'count': count}
+                for (key, period, bucket, event, hwid), count in rows.items()
+            ]
+            # Пачками, чтобы не упереться в лимит параметров запроса
+            for start in range(0, len(values_list), ACTIVITY_UPSERT_CHUNK):
+                insert = dialect_insert(table).values(values_list[start:start + ACTIVITY_UPSERT_CHUNK])
+                db.session.execute(insert.on_conflict_do_update(
+                    index_elements=['key', 'period', 'bucket', 'event', 'hwid'],
+                    set_={'count': table.c.count + insert.excluded.count}
+                ))
+        else:
+            for (key, period, bucket, event, hwid), count in rows.items():
+                result = db.session.execute(
+                    table.update()
+                    .where(table.c.key == key, table.c.period == period, table.c.bucket == bucket,
+                           table.c.event == event, table.c.hwid == hwid)
+                    .values(count=table.c.count + count)
+                )
+                if result.rowcount == 0:
+                    db.session.execute(table.insert().values(
+                        key=key, period=period, bucket=bucket, event=event, hwid=hwid, count=count
+                    ))
+    
+    def flush(self):
+        """Прибавляет накопленные счетчики к часовым и дневным сводкам одним commit.
+        Если пакет не записался, события пишутся по одному: ошибочное событие
+        не блокирует остальные и отбрасывается после ACTIVITY_MAX_RETRIES попыток."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        try:
+            rows = self._rows(pending.items())
+            self._upsert(rows)
+            db.session.commit()
+            with self._lock:
+                for entry in pending:
+                    self._retries.pop(entry, None)
+            return len(rows)
+        except Exception:
+            logger.exception('Error flushing license activity', extra={'fields': {'pending': len(pending)}})
+            db.session.rollback()
+        
+        written = 0
+        for entry, count in pending.items():
+            try:
+                rows = self._rows([(entry, count)])
+                self._upsert(rows)
+                db.session.commit()
+                written += len(rows)
+                with self._lock:
+                    self._retries.pop(entry, None)
+            except Exception as e:
+                db.session.rollback()
+                with self._lock:
+                    retries = self._retries.get(entry, 0) + 1
+                    if retries < ACTIVITY_MAX_RETRIES:
+                        # Возвращаем счетчик в буфер, чтобы не потерять события
+                        self._retries[entry] = retries
+                        self._pending[entry] = self._pending.get(entry, 0) + count
+                        continue
+                    self._retries.pop(entry, None)
+                logger.warning('Dropped license activity after repeated write errors', extra={'fields': {
+                    'key': entry[0], 'event': entry[1], 'count': count, 'error': str(e)
+                }})
+        return written
+
+activity_buffer = ActivityBuffer(
+    max_pending=int(os.environ.get('ACTIVITY_MAX_PENDING', 10000))
+)
+
+def flush_activity():
+    """Сбрасывает буфер событий лицензий (планировщик и завершение воркера)"""
+    with app.app_context():
+        return activity_buffer.flush()
+
+scheduler.add_job(flush_activity, 'interval', seconds=HEARTBEAT_FLUSH_INTERVAL,
+                  id='activity_flush', max_instances=1, coalesce=True)
+atexit.register(flush_activity)
+
+# Часовые сводки нужны для графиков за последние дни, дневные - для истории
+ACTIVITY_HOURLY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_HOURLY_RETENTION_DAYS', 14))
+ACTIVITY_DAILY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_DAILY_RETENTION_DAYS', 365))
+
+def prune_license_activity():
+    """Удаляет сводки старше срока хранения своей детализации"""
+    with app.app_context():
         try:
+            now = datetime.utcnow()
+            deleted = 0
+            for period, days in (('hour', ACTIVITY_HOURLY_RETENTION_DAYS), ('day', ACTIVITY_DAILY_RETENTION_DAYS)):
+                deleted += LicenseActivity.query.filter(
+                    LicenseActivity.period == period,
+                    LicenseActivity.bucket < now - timedelta(days=days)
+                ).delete(synchronize_session=False)
             db.session.commit()
-            print(f"⏰ License {license_obj.key} automatically deactivated due to expiry")
-        except Exception as e:
-            print(f"❌ Error deactivating expired license: {e}")
+            if deleted:
+                logger.info('Removed expired license activity rollups', extra={'fields': {'count': deleted}})
+            return deleted
+        except Exception:
+            logger.exception('Error pruning license activity')
             db.session.rollback()
+            return 0
+
+scheduler.add_job(prune_license_activity, 'interval', hours=1,
+                  id='license_activity_retention', max_instances=1, coalesce=True)
+
+class Metrics:
+    """Счетчики и гистограммы в формате Prometheus (в пределах одного процесса)"""
+    
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+    
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {
+                    'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0
+                }
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+    
+    def snapshot(self):
+        """Сериализуемый снимок для объединения между воркерами"""
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), dict(hist, counts=list(hist['counts']))]
+                               for (name, labels), hist in self._histograms.items()]
+            }
+
+metrics = Metrics()
+
+# Снимки метрик воркеров gunicorn складываются в общий каталог
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'license-server-metrics'))
+METRICS_SNAPSHOT_INTERVAL = int(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 15))
+
+# Профилирование SQL: запись всех запросов к базе в рамках HTTP-запроса и бюджеты
+SQL_PROFILE = os.environ.get('SQL_PROFILE') == '1'
+SQL_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 0))
+SQL_TIME_BUDGET_MS = float(os.environ.get('SQL_TIME_BUDGET_MS', 0))
+# Одинаковый запрос, повторенный столько раз за HTTP-запрос, считается признаком N+1
+SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 5))
+
+_query_counters = threading.local()
+
+class QueryCounter:
+    """Считает запросы к базе в текущем потоке, в том числе вне HTTP-запроса"""
+    def __init__(self):
+        self.statements = []
+    
+    @property
+    def count(self):
+        return len(self.statements)
+    
+    @property
+    def total_time(self):
+        return sum(elapsed for _, elapsed in self.statements)
+    
+    def record(self, statement, elapsed):
+        self.statements.append((statement, elapsed))
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    stack = _query_counters.__dict__.setdefault('stack', [])
+    stack.append(counter)
+    try:
+        yield counter
+    finally:
+        stack.remove(counter)
+
+@contextmanager
+def assert_max_queries(limit):
+    """Падает с AssertionError, если блок выполнил больше `limit` запросов к базе"""
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        statements = '\n'.join(statement for statement, _ in counter.statements)
+        raise AssertionError(f'{counter.count} queries executed, expected at most {limit}:\n{statements}')
+
+def find_repeated_statements(statements, threshold=SQL_REPEAT_THRESHOLD):
+    """Запросы, выполненные не меньше threshold раз (параметры в тексте не участвуют)"""
+    counts = {}
+    for statement, _ in statements:
+        counts[statement] = counts.get(statement, 0) + 1
+    return {statement: n for statement, n in counts.items() if n >= threshold}
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    metrics.inc('db_queries_total')
+    metrics.inc('db_query_seconds_total', value=elapsed)
+    for counter in getattr(_query_counters, 'stack', ()):
+        counter.record(statement, elapsed)
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + elapsed
+        if SQL_PROFILE:
+            g.setdefault('db_statements', []).append((statement, elapsed))
+
+def check_query_budget(route):
+    """Логирует запросы, превысившие бюджет по числу запросов к базе или времени в ней"""
+    queries = g.get('db_queries', 0)
+    db_time_ms = g.get('db_time', 0.0) * 1000
+    statements = g.get('db_statements', [])
+    repeated = find_repeated_statements(statements) if statements else {}
+    
+    over_count = SQL_QUERY_BUDGET and queries > SQL_QUERY_BUDGET
+    over_time = SQL_TIME_BUDGET_MS and db_time_ms > SQL_TIME_BUDGET_MS
+    if not (over_count or over_time or repeated):
+        return
+    
+    metrics.inc('db_budget_exceeded_total', (('route', route),))
+    slowest = sorted(statements, key=lambda item: item[1], reverse=True)[:5]
+    logger.warning('SQL budget exceeded', extra={'fields': {
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'db_queries': queries,
+        'db_time_ms': round(db_time_ms, 2),
+        # Повторяющиеся запросы - вероятный N+1
+        'repeated_statements': [{'statement': statement, 'count': count} for statement, count in repeated.items()],
+        'slowest_statements': [{'statement': statement, 'ms': round(elapsed * 1000, 2)} for statement, elapsed in slowest]
+    }})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Идентификатор от прокси/клиента или новый; попадает во все записи лога запроса
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if 0 < len(request_id) <= 128 and request_id.isprintable() else uuid.uuid4().hex
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    action = g.get('metrics_action', '')
+    metrics.inc('http_requests_total', (('route', route), ('method', request.method),
+                                        ('action', action), ('status', str(response.status_code))))
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                    (('route', route), ('action', action)))
+    metrics.observe('db_queries_per_request', g.get('db_queries', 0), (('route', route),),
+                    buckets=Metrics.COUNT_BUCKETS)
+    
+    if SQL_PROFILE or SQL_QUERY_BUDGET or SQL_TIME_BUDGET_MS:
+        check_query_budget(route)
+    if SQL_PROFILE:
+        response.headers['Server-Timing'] = (
+            f'db;dur={g.get("db_time", 0.0) * 1000:.2f};desc="{g.get("db_queries", 0)} queries"'
+        )
+    response.headers['X-Request-ID'] = g.request_id
+    log_request(route, action, response, time.perf_counter() - started)
+    return response
+
+def log_request(route, action, response, duration):
+    """Журнал запросов; частые проверки лицензий пишутся выборочно, ошибки - всегда"""
+    sample_rate = 1.0
+    if action == 'validate' or route == '/license/batch':
+        sample_rate = LOG_VALIDATION_SAMPLE_RATE
+    if response.status_code < 500 and random.random() >= sample_rate:
+        return
+    
+    logger.info('Request handled', extra={'fields': {
+        'method': request.method,
+        'route': route,
+        'action': action,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'db_queries': g.get('db_queries', 0),
+        'remote_addr': request.remote_addr,
+        'sample_rate': sample_rate
+    }})
+
+def collect_process_metrics():
+    """Метрики текущего процесса: счетчики, пул соединений, кэш, ресурсы"""
+    data = metrics.snapshot()
+    pid = str(os.getpid())
+    gauges = []
+    
+    cache = license_cache.stats()
+    for name in ('hits', 'misses', 'evictions'):
+        data['counters'].append([f'license_cache_{name}_total', [], cache[name]])
+    gauges.append(['license_cache_size', [['pid', pid]], cache['size']])
+    gauges.append(['heartbeat_buffer_pending', [['pid', pid]], heartbeat_buffer.pending()])
+    gauges.append(['activity_buffer_pending', [['pid', pid]], activity_buffer.pending()])
+    
+    with app.app_context():
+        pool = db.engine.pool
+        if hasattr(pool, 'checkedout'):
+            gauges.append(['db_pool_checked_out', [['pid', pid]], pool.checkedout()])
+        if hasattr(pool, 'size'):
+            gauges.append(['db_pool_size', [['pid', pid]], pool.size()])
+    
+    process = psutil.Process()
+    cpu = process.cpu_times()
+    data['counters'].append(['process_cpu_seconds_total', [], cpu.user + cpu.system])
+    gauges.append(['process_resident_memory_bytes', [['pid', pid]], process.memory_info().rss])
+    
+    data['gauges'] = gauges
+    return data
+
+def write_metrics_snapshot():
+    """Сохраняет снимок метрик процесса для /metrics в других воркерах"""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f'metrics-{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(collect_process_metrics(), f)
+        os.replace(tmp_path, path)
+    except Exception:
+        logger.exception('Error writing metrics snapshot')
+
+def load_worker_snapshots():
+    """Снимки остальных живых воркеров; файлы завершившихся удаляются"""
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        try:
+            pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+            if pid == os.getpid():
+                continue
+            if not psutil.pid_exists(pid):
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (ValueError, OSError):
+            continue
+    return snapshots
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def render_metrics(snapshots):
+    """Объединяет снимки воркеров и выводит текстовый формат Prometheus"""
+    counters, histograms, gauges = {}, {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, hist in snap['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, {
+                'buckets': hist['buckets'], 'counts': [0] * len(hist['buckets']), 'sum': 0.0, 'count': 0
+            })
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], hist['counts'])]
+            merged['sum'] += hist['sum']
+            merged['count'] += hist['count']
+        for name, labels, value in snap.get('gauges', []):
+            gauges[(name, tuple(map(tuple, labels)))] = value
+    
+    lines = []
+    for kind, series in (('counter', counters), ('gauge', gauges)):
+        typed = set()
+        for (name, labels), value in sorted(series.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} {kind}')
+                typed.add(name)
+            lines.append(f'{name}{format_labels(labels)} {value}')
     
-    return is_expired
+    typed = set()
+    for (name, labels), hist in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} histogram')
+            typed.add(name)
+        for bound, count in zip(hist['buckets'], hist['counts']):
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {count}')
+        lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {hist["count"]}')
+        lines.append(f'{name}_sum{format_labels(labels)} {hist["sum"]}')
+        lines.append(f'{name}_count{format_labels(labels)} {hist["count"]}')
+    
+    return '\n'.join(lines) + '\n'
+
+scheduler.add_job(prune_activation_requests, 'interval', hours=1,
+                  id='activation_request_retention', max_instances=1, coalesce=True)
+
+scheduler.add_job(write_metrics_snapshot, 'interval', seconds=METRICS_SNAPSHOT_INTERVAL,
+                  id='metrics_snapshot', max_instances=1, coalesce=True)
+
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background_jobs():
+    """Запускает планировщик в текущем процессе (после fork - заново в каждом воркере)"""
+    global _background_pid
+    if _background_pid == os.getpid() or os.environ.get('DISABLE_SCHEDULER') == '1':
+        return
+    
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        if _background_pid is None:
+            scheduler.start()
+            atexit.register(lambda: scheduler.shutdown(wait=False))
+        else:
+            # Потоки родителя не переживают fork: поднимаем планировщик заново
+            scheduler.shutdown(wait=False)
+            scheduler.start()
+        _background_pid = os.getpid()
+
+def init_worker():
+    """Подготовка воркера после fork: свои соединения с базой и свой планировщик"""
+    with app.app_context():
+        # Соединения, открытые до fork, не должны использоваться в дочернем процессе
+        db.engine.dispose(close=False)
+    start_background_jobs()
+
+@app.before_request
+def ensure_background_jobs():
+    if _background_pid != os.getpid():
+        start_background_jobs()
+
+def is_valid_key_format(key):
+    """Формат ключа: PFIZER-XXXX-XXXX-XXXX-XXXX"""
+    return len(key) == 26 and key.startswith('PFIZER-')
+
+def parse_local_datetime(value):
+    """Парсит локальное время из формы (UTC+2 для Калининграда) и возвращает UTC"""
+    return datetime.fromisoformat(value) - timedelta(hours=2)
+
+_read_engine = {'engine': None, 'pid': None, 'failed_until': 0.0}
+_read_engine_lock = threading.Lock()
+
+def get_read_engine():
+    """Движок реплики создается лениво и заново в каждом процессе после fork"""
+    if not DATABASE_READ_URL:
+        return None
+    with _read_engine_lock:
+        if _read_engine['pid'] != os.getpid():
+            _read_engine['engine'] = create_engine(
+                DATABASE_READ_URL, **engine_options(DATABASE_READ_URL, 'DB_READ')
+            )
+            _read_engine['pid'] = os.getpid()
+        return _read_engine['engine']
+
+def read_all(stmt):
+    """Выполняет чтение на реплике, при ее недоступности - на основной базе"""
+    engine = get_read_engine()
+    if engine is not None and time.monotonic() >= _read_engine['failed_until']:
+        try:
+            with engine.connect() as conn:
+                return conn.execute(stmt).all()
+        except DBAPIError as e:
+            # Не пытаемся подключиться к реплике на каждом запросе, пока она недоступна
+            logger.warning('Read replica unavailable, falling back to primary',
+                           extra={'fields': {'error': str(e.orig), 'retry_in': REPLICA_RETRY_INTERVAL}})
+            _read_engine['failed_until'] = time.monotonic() + REPLICA_RETRY_INTERVAL
+            metrics.inc('db_replica_fallback_total')
+    return db.session.execute(stmt).all()
+
+def is_suspect_replica_result(row, hwids, now):
+    """Отрицательный ответ реплики может быть следствием отставания репликации"""
+    if row is None or (row.expiry_date and row.expiry_date < now):
+        return True
+    return any(get_validation_error(row._mapping, hwid) for hwid in hwids)
 
 def get_local_time(utc_time):
     """Конвертирует UTC время в локальное (UTC+2 для Калининграда)"""
@@ -135,12 +1129,205 @@ def get_local_time(utc_time):
         return None
     return utc_time.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=2)))
 
+# Офлайн-токены лицензий.
+# Формат: base64url(JSON payload) + "." + base64url(HMAC-SHA256(payload)),
+# payload: k - ключ, h - HWID, i - время выдачи (unix time с миллисекундами),
+# e - время истечения токена (unix time).
+# Релеи с LICENSE_TOKEN_SECRET проверяют токен сами и периодически
+# забирают /license/revocations; токен ключа, выданный до отзыва, недействителен.
+# Без LICENSE_TOKEN_SECRET ключ выводится из SECRET_KEY: релею передается только он,
+# ключ подписи сессий админки остается на сервере (flask --app app token-secret)
+LICENSE_TOKEN_SECRET = (
+    os.environ.get('LICENSE_TOKEN_SECRET')
+    or hmac.new(app.config['SECRET_KEY'].encode(), b'license-token', hashlib.sha256).hexdigest()
+).encode()
+LICENSE_TOKEN_TTL = int(os.environ.get('LICENSE_TOKEN_TTL', 3600))
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def sign_token_body(body):
+    return _b64encode(hmac.new(LICENSE_TOKEN_SECRET, body.encode(), hashlib.sha256).digest())
+
+@app.cli.command('token-secret')
+def token_secret_command():
+    """Печатает ключ подписи офлайн-токенов для настройки релеев"""
+    print(LICENSE_TOKEN_SECRET.decode())
+
+def issue_license_token(key, hwid, expiry_date=None, issued_at=None):
+    """Выдает подписанный токен, не переживающий срок действия лицензии.
+    issued_at - момент чтения состояния лицензии из базы: токен по состоянию из кэша
+    не должен считаться выданным после отзыва, случившегося уже после чтения."""
+    if issued_at is None:
+        issued_at = time.time()
+    # Округляем вниз до миллисекунд: токен не может оказаться "новее" отзыва
+    issued_at = math.floor(issued_at * 1000) / 1000
+    expires_at = int(issued_at) + LICENSE_TOKEN_TTL
+    if expiry_date:
+        expires_at = min(expires_at, int(expiry_date.replace(tzinfo=timezone.utc).timestamp()))
+    
+    payload = {'k': key, 'h': hwid, 'i': issued_at, 'e': expires_at}
+    body = _b64encode(json.dumps(payload, separators=(',', ':')).encode())
+    return f'{body}.{sign_token_body(body)}'
+
+def verify_license_token(token, hwid=None, now=None):
+    """Проверяет подпись, срок и HWID токена; возвращает payload или None"""
+    try:
+        body, signature = token.split('.')
+        # Сравниваем байты: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(signature.encode(), sign_token_body(body).encode()):
+            return None
+        payload = json.loads(_b64decode(body))
+    except (ValueError, AttributeError, TypeError):
+        return None
+    
+    if payload['e'] <= (now or time.time()):
+        return None
+    if hwid is not None and payload['h'] != hwid:
+        return None
+    return payload
+
+def hash_license_key(key):
+    """Ключи в списке отзыва публикуются только в виде хэша"""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def revoke_license_tokens(keys):
+    """Отзывает ранее выданные токены (коммит делает вызывающий код)"""
+    now = datetime.utcnow()
+    if keys:
+        db.session.execute(TokenRevocation.__table__.insert(),
+                           [{'key': key, 'revoked_at': now} for key in keys])
+
+def prune_token_revocations():
+    """Отзывы старше TTL токена больше не нужны: такие токены уже истекли"""
+    cutoff = datetime.utcnow() - timedelta(seconds=LICENSE_TOKEN_TTL)
+    TokenRevocation.query.filter(TokenRevocation.revoked_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+class MemoryRateLimitBackend:
+    """Token bucket в памяти процесса (лимиты действуют в пределах воркера)"""
+    
+    MAX_BUCKETS = 100000
+    
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def consume(self, bucket_id, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(bucket_id, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[bucket_id] = (tokens, now)
+            
+            # Давно не использованные корзины можно забыть
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets = {
+                    bid: (t, u) for bid, (t, u) in self._buckets.items() if now - u < 3600
+                }
+            return allowed
+
+class SQLiteRateLimitBackend:
+    """Token bucket в локальном файле SQLite, общий для всех воркеров на хосте"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+    
+    def _connection(self):
+        # Соединение на поток и на процесс: после fork открываем заново
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (id TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def consume(self, bucket_id, rate, burst, now):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE id = ?', (bucket_id,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets (id, tokens, updated) VALUES (?, ?, ?)',
+                         (bucket_id, tokens, now))
+            conn.execute('COMMIT')
+            return allowed
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    
+    def prune(self, max_age):
+        conn = self._connection()
+        conn.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - max_age,))
+
+def parse_rate_limit(value):
+    """Лимит в формате "запросов_в_секунду/запас", пустая строка - без лимита"""
+    if not value:
+        return None
+    rate, burst = value.split('/')
+    return float(rate), float(burst)
+
+class RateLimiter:
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = {scope: limit for scope, limit in limits.items() if limit}
+    
+    def allow(self, scope, ident):
+        limit = self.limits.get(scope)
+        if limit is None or not ident:
+            return True
+        
+        rate, burst = limit
+        try:
+            return self.backend.consume(f'{scope}:{ident}', rate, burst, time.time())
+        except Exception:
+            # Сбой хранилища лимитов не должен блокировать клиентов
+            logger.exception('Rate limiter error')
+            return True
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')
+
+if RATE_LIMIT_BACKEND == 'memory':
+    rate_limit_backend = MemoryRateLimitBackend()
+else:
+    rate_limit_backend = SQLiteRateLimitBackend(
+        os.environ.get('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'license-server-ratelimit.db'))
+    )
+
+rate_limiter = RateLimiter(rate_limit_backend, {
+    'ip': parse_rate_limit(os.environ.get('RATE_LIMIT_PER_IP', '20/100')),
+    'key': parse_rate_limit(os.environ.get('RATE_LIMIT_PER_KEY', '1/30'))
+})
+
+def rate_limit_response(key=None):
+    """Возвращает ответ 429, если превышен лимит по IP или по ключу"""
+    for scope, ident in (('ip', request.remote_addr), ('key', key)):
+        if not rate_limiter.allow(scope, ident):
+            metrics.inc('rate_limited_total', (('scope', scope),))
+            response = jsonify({'success': False, 'valid': False, 'error': 'Too many requests'})
+            return response, 429, {'Retry-After': '1'}
+    return None
+
 # API endpoints
 @app.route('/license', methods=['POST'])
 def license_api():
-    # ПРИНУДИТЕЛЬНО проверяем ВСЕ лицензии при каждом запросе
-    check_all_licenses_expiry()
-    
+    # Истечение проверяется лениво для конкретной лицензии,
+    # общая проверка выполняется фоновым планировщиком
     try:
         data = request.get_json()
         if not data:
@@ -149,6 +1336,11 @@ def license_api():
         action = data.get('action')
         key = data.get('key')
         hwid = data.get('hwid')
+        g.metrics_action = action if action in ('activate', 'validate') else 'invalid'
+        
+        limited = rate_limit_response(key)
+        if limited:
+            return limited
         
         if not key:
             return jsonify({'success': False, 'error': 'No key provided'})
@@ -164,82 +1356,310 @@ def license_api():
 
 def activate_license(key, hwid, request):
     try:
-        license_obj = License.query.filter_by(key=key).first()
+        now = datetime.utcnow()
+        # Только нужные колонки, без загрузки ORM-объекта: решение принимается в памяти,
+        # а запись выполняется, только если состояние действительно меняется
+        row = db.session.execute(
+            db.select(License.hwid, License.is_active, License.expiry_date).where(License.key == key)
+        ).first()
         
-        if not license_obj:
+        if not row:
             return jsonify({'success': False, 'error': 'Invalid license key'})
         
         # Проверяем конкретную лицензию
-        if is_license_expired(license_obj):
+        if row.expiry_date and row.expiry_date < now:
+            if row.is_active:
+                deactivate_expired_license(key)
             return jsonify({'success': False, 'error': 'License has expired and was deactivated'})
         
-        if not license_obj.is_active:
+        if not row.is_active:
             return jsonify({'success': False, 'error': 'License is deactivated'})
         
-        if license_obj.hwid:
-            if license_obj.hwid == hwid:
-                return jsonify({
-                    'success': True, 
-                    'message': 'License already activated on this device',
-                    'license_data': {'status': 'active'}
-                })
-            else:
-                activation_req = ActivationRequest(
-                    key=key,
-                    hwid=hwid,
-                    ip_address=request.remote_addr,
-                    user_agent=request.headers.get('User-Agent')
-                )
-                db.session.add(activation_req)
-                db.session.commit()
-                
+        bound_hwid = row.hwid
+        if not bound_hwid:
+            # Привязка только к свободной лицензии: из двух одновременных активаций побеждает одна
+            result = db.session.execute(
+                db.update(License)
+                .where(License.key == key, License.hwid.is_(None))
+                .values(hwid=hwid, activation_date=now, last_validation=now)
+            )
+            db.session.commit()
+            if result.rowcount:
+                license_cache.invalidate(key)
+                record_activity(key, 'activate', hwid)
                 return jsonify({
-                    'success': False, 
-                    'error': 'License already activated on another device. Activation request sent to admin.'
+                    'success': True,
+                    'message': 'License activated successfully',
+                    'license_data': {'status': 'active'},
+                    'token': issue_license_token(key, hwid, row.expiry_date)
                 })
+            bound_hwid = db.session.execute(db.select(License.hwid).where(License.key == key)).scalar()
         
-        license_obj.hwid = hwid
-        license_obj.activation_date = datetime.utcnow()
-        license_obj.last_validation = datetime.utcnow()
+        if bound_hwid == hwid:
+            record_activity(key, 'activate', hwid)
+            return jsonify({
+                'success': True, 
+                'message': 'License already activated on this device',
+                'license_data': {'status': 'active'},
+                'token': issue_license_token(key, hwid, row.expiry_date)
+            })
         
+        record_activation_request(key, hwid, request.remote_addr, request.headers.get('User-Agent'))
         db.session.commit()
+        record_activity(key, 'rejected', hwid)
         
         return jsonify({
-            'success': True,
-            'message': 'License activated successfully',
-            'license_data': {'status': 'active'}
+            'success': False, 
+            'error': 'License already activated on another device. Activation request sent to admin.'
         })
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': f'Activation error: {str(e)}'})
 
+def get_cached_state(key, now, hwids):
+    """Берет состояние лицензии из кэша, только если оно подтверждает проверку.
+    Кэш сбрасывается лишь в воркере, изменившем лицензию: отрицательный ответ
+    (другое устройство) мог устареть после активации или одобрения в другом
+    воркере, поэтому он всегда перепроверяется в базе."""
+    state = license_cache.get(key)
+    if state is None:
+        return None
+    if state['expiry_date'] and state['expiry_date'] < now:
+        license_cache.invalidate(key)
+        return None
+    if any(get_validation_error(state, hwid) for hwid in hwids):
+        return None
+    return state
+
+def cache_license_state(key, state):
+    """Кэшируются только состояния, при которых проверка может пройти"""
+    if state['is_active'] and state['hwid']:
+        license_cache.set(key, state)
+
+def get_validation_error(state, hwid):
+    """Возвращает ошибку проверки для неистекшей лицензии или None"""
+    if not state['is_active']:
+        return 'License is deactivated'
+    
+    if not state['hwid']:
+        return 'License not activated'
+    
+    if state['hwid'] != hwid:
+        return 'License not valid for this device'
+    
+    return None
+
+def record_heartbeat(key):
+    """last_validation записывается в базу пакетно, с задержкой до HEARTBEAT_FLUSH_INTERVAL"""
+    if heartbeat_buffer.record(key, datetime.utcnow()):
+        heartbeat_buffer.flush()
+
+def record_activity(key, event, hwid):
+    """Событие для истории активности ключа; запись в сводки - пакетно, вне запроса"""
+    if activity_buffer.record(key, event, hwid, datetime.utcnow()):
+        activity_buffer.flush()
+
+def dialect_insert(table):
+    """INSERT с поддержкой ON CONFLICT для PostgreSQL и SQLite, иначе None"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return pg_insert(table)
+    if dialect == 'sqlite':
+        return sqlite_insert(table)
+    return None
+
+def record_activation_request(key, hwid, ip_address, user_agent):
+    """Создает запрос на активацию или увеличивает счетчик попыток ожидающего"""
+    now = datetime.utcnow()
+    table = ActivationRequest.__table__
+    updates = {
+        'attempts': table.c.attempts + 1,
+        'last_seen': now,
+        'ip_address': ip_address,
+        'user_agent': user_agent
+    }
+    
+    insert = dialect_insert(table)
+    if insert is not None:
+        db.session.execute(
+            insert.values(key=key, hwid=hwid, ip_address=ip_address, user_agent=user_agent,
+                          status='pending', attempts=1, created_at=now, last_seen=now)
+            .on_conflict_do_update(index_elements=['key', 'hwid'],
+                                   index_where=table.c.status == 'pending',
+                                   set_=updates)
+        )
+        return
+    
+    result = db.session.execute(
+        table.update()
+        .where(table.c.key == key, table.c.hwid == hwid, table.c.status == 'pending')
+        .values(**updates)
+    )
+    if result.rowcount == 0:
+        db.session.add(ActivationRequest(key=key, hwid=hwid, ip_address=ip_address,
+                                         user_agent=user_agent, created_at=now, last_seen=now))
+
 def validate_license(key, hwid):
     try:
-        license_obj = License.query.filter_by(key=key).first()
+        now = datetime.utcnow()
+        state = get_cached_state(key, now, [hwid])
         
-        if not license_obj:
-            return jsonify({'valid': False, 'error': 'Invalid license key'})
+        if state is None:
+            # Время засекается до чтения: токены по этому состоянию не новее его
+            loaded_at = time.time()
+            stmt = db.select(License.hwid, License.is_active, License.expiry_date).where(License.key == key)
+            row = next(iter(read_all(stmt)), None)
+            if DATABASE_READ_URL and is_suspect_replica_result(row, [hwid], now):
+                row = db.session.execute(stmt).first()
+            
+            if not row:
+                return jsonify({'valid': False, 'error': 'Invalid license key'})
+            
+            # Проверяем конкретную лицензию
+            if row.expiry_date and row.expiry_date < now:
+                if row.is_active:
+                    deactivate_expired_license(key)
+                return jsonify({'valid': False, 'error': 'License has expired and was deactivated'})
+            
+            state = {
+                'hwid': row.hwid,
+                'is_active': row.is_active,
+                'expiry_date': row.expiry_date,
+                'loaded_at': loaded_at
+            }
+            cache_license_state(key, state)
         
-        # Проверяем конкретную лицензию
-        if is_license_expired(license_obj):
-            return jsonify({'valid': False, 'error': 'License has expired and was deactivated'})
+        error = get_validation_error(state, hwid)
+        if error:
+            if state['hwid'] and state['hwid'] != hwid:
+                record_activity(key, 'rejected', hwid)
+            return jsonify({'valid': False, 'error': error})
         
-        if not license_obj.is_active:
-            return jsonify({'valid': False, 'error': 'License is deactivated'})
+        record_heartbeat(key)
+        record_activity(key, 'validate', hwid)
         
-        if not license_obj.hwid:
-            return jsonify({'valid': False, 'error': 'License not activated'})
+        return jsonify({
+            'valid': True,
+            'message': 'License is valid',
+            'token': issue_license_token(key, hwid, state['expiry_date'], state['loaded_at'])
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'valid': False, 'error': f'Validation error: {str(e)}'})
+
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+
+def validate_license_batch(items):
+    """Проверяет список пар (key, hwid) одним запросом к базе"""
+    now = datetime.utcnow()
+    states = {}
+    
+    # Значения приходят от клиента: не строки не используются как ключи словарей
+    items = [{
+        'key': item.get('key') if isinstance(item.get('key'), str) else None,
+        'hwid': item.get('hwid') if isinstance(item.get('hwid'), str) else None
+    } if isinstance(item, dict) else {} for item in items]
+    
+    hwids = {}
+    for item in items:
+        if item.get('key'):
+            hwids.setdefault(item['key'], set()).add(item['hwid'])
+    
+    keys = set(hwids)
+    for key in keys:
+        state = get_cached_state(key, now, hwids[key])
+        if state is not None:
+            states[key] = state
+    
+    missing = [key for key in keys if key not in states]
+    expired = set()
+    if missing:
+        loaded_at = time.time()
+        stmt = (
+            db.select(License.key, License.hwid, License.is_active, License.expiry_date)
+            .where(License.key.in_(missing))
+        )
+        rows = {row.key: row for row in read_all(stmt)}
+        if DATABASE_READ_URL:
+            suspect = [key for key in missing if is_suspect_replica_result(rows.get(key), hwids[key], now)]
+            if suspect:
+                rows.update({row.key: row for row in db.session.execute(stmt.where(License.key.in_(suspect)))})
         
-        if license_obj.hwid != hwid:
-            return jsonify({'valid': False, 'error': 'License not valid for this device'})
+        to_deactivate = []
+        for row in rows.values():
+            if row.expiry_date and row.expiry_date < now:
+                expired.add(row.key)
+                if row.is_active:
+                    to_deactivate.append(row.key)
+                continue
+            
+            state = {
+                'hwid': row.hwid,
+                'is_active': row.is_active,
+                'expiry_date': row.expiry_date,
+                'loaded_at': loaded_at
+            }
+            states[row.key] = state
+            cache_license_state(row.key, state)
         
-        license_obj.last_validation = datetime.utcnow()
-        db.session.commit()
+        # Истекшие лицензии деактивируем одним UPDATE
+        if to_deactivate:
+            License.query.filter(License.key.in_(to_deactivate)).update(
+                {License.is_active: False}, synchronize_session=False
+            )
+            db.session.commit()
+    
+    results = []
+    for item in items:
+        key = item.get('key')
+        hwid = item.get('hwid')
+        
+        if not key:
+            results.append({'key': key, 'valid': False, 'error': 'No key provided'})
+        elif key in expired:
+            results.append({'key': key, 'valid': False, 'error': 'License has expired and was deactivated'})
+        elif key not in states:
+            results.append({'key': key, 'valid': False, 'error': 'Invalid license key'})
+        else:
+            error = get_validation_error(states[key], hwid)
+            if error:
+                if states[key]['hwid'] and states[key]['hwid'] != hwid:
+                    record_activity(key, 'rejected', hwid)
+                results.append({'key': key, 'valid': False, 'error': error})
+            else:
+                record_heartbeat(key)
+                record_activity(key, 'validate', hwid)
+                results.append({
+                    'key': key,
+                    'valid': True,
+                    'message': 'License is valid',
+                    'token': issue_license_token(key, hwid, states[key]['expiry_date'], states[key]['loaded_at'])
+                })
+    
+    return results
+
+@app.route('/license/batch', methods=['POST'])
+def license_batch():
+    try:
+        limited = rate_limit_response()
+        if limited:
+            return limited
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'success': False, 'error': 'No JSON data provided'})
         
-        return jsonify({'valid': True, 'message': 'License is valid'})
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'No items provided'})
+        
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'success': False, 'error': f'Too many items (max {MAX_BATCH_SIZE})'})
+        
+        return jsonify({'success': True, 'results': validate_license_batch(items)})
     except Exception as e:
         db.session.rollback()
-        return jsonify({'valid': False, 'error': f'Validation error: {str(e)}'})
+        return jsonify({'success': False, 'error': f'Batch validation error: {str(e)}'})
 
 # Админ панель
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -262,27 +1682,72 @@ def admin_logout():
     session.pop('admin_logged_in', None)
     return redirect(url_for('admin_login'))
 
+DASHBOARD_PENDING_LIMIT = 100
+STATS_CACHE_TTL = int(os.environ.get('STATS_CACHE_TTL', 10))
+
+_stats_cache = {'value': None, 'computed_at': 0.0}
+_stats_lock = threading.Lock()
+
+def compute_dashboard_stats():
+    """Считает все счетчики админки одним агрегирующим запросом"""
+    now = datetime.utcnow()
+    
+    def count_if(condition):
+        return db.func.coalesce(db.func.sum(case((condition, 1), else_=0)), 0)
+    
+    pending_requests = (
+        db.select(db.func.count(ActivationRequest.id))
+        .where(ActivationRequest.status == 'pending')
+        .scalar_subquery()
+    )
+    row = db.session.execute(db.select(
+        db.func.count(License.id).label('total_licenses'),
+        db.func.count(License.hwid).label('activated_licenses'),
+        count_if(License.expiry_date < now).label('expired_licenses'),
+        count_if(and_(License.expiry_date >= now,
+                      License.expiry_date < now + timedelta(days=7))).label('expiring_7d'),
+        count_if(License.last_validation >= now - timedelta(hours=24)).label('validated_24h'),
+        pending_requests.label('pending_requests')
+    )).one()
+    
+    return {name: int(value or 0) for name, value in row._mapping.items()}
+
+def get_dashboard_stats():
+    """Статистика админки с кэшированием на STATS_CACHE_TTL секунд"""
+    with _stats_lock:
+        if _stats_cache['value'] and time.monotonic() - _stats_cache['computed_at'] < STATS_CACHE_TTL:
+            return _stats_cache['value']
+    
+    stats = compute_dashboard_stats()
+    with _stats_lock:
+        _stats_cache['value'] = stats
+        _stats_cache['computed_at'] = time.monotonic()
+    return stats
+
+def invalidate_dashboard_stats():
+    """Сбрасывает кэш статистики после изменений из админки"""
+    with _stats_lock:
+        _stats_cache['value'] = None
+
 @app.route('/admin/')
 def admin_dashboard():
     if not session.get('admin_logged_in'):
         return redirect(url_for('admin_login'))
     
     try:
-        # ПРИНУДИТЕЛЬНО проверяем ВСЕ лицензии при загрузке админки
-        expired_count = check_all_licenses_expiry()
-        
-        licenses = License.query.all()
-        activation_requests = ActivationRequest.query.filter_by(status='pending').all()
-        stats = {
-            'total_licenses': License.query.count(),
-            'activated_licenses': License.query.filter(License.hwid.isnot(None)).count(),
-            'pending_requests': ActivationRequest.query.filter_by(status='pending').count()
-        }
+        # Истекшие лицензии деактивирует планировщик, список лицензий
+        # подгружается страницами через /admin/api/licenses
+        activation_requests = (
+            ActivationRequest.query.filter_by(status='pending')
+            .order_by(ActivationRequest.last_seen.desc())
+            .limit(DASHBOARD_PENDING_LIMIT)
+            .all()
+        )
+        stats = get_dashboard_stats()
         
         now = datetime.utcnow()
         
         return render_template('admin_dashboard.html', 
-                             licenses=licenses, 
                              activation_requests=activation_requests,
                              stats=stats,
                              now=now,
@@ -290,6 +1755,171 @@ def admin_dashboard():
     except Exception as e:
         return f"Error loading dashboard: {str(e)}", 500
 
+@app.route('/admin/api/stats')
+def admin_stats():
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    try:
+        return jsonify({'success': True, 'stats': get_dashboard_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Error loading stats: {str(e)}'})
+
+LICENSE_STATUSES = ('active', 'pending', 'inactive', 'expired')
+
+def apply_license_filters(query, search=None, status=None, now=None):
+    """Фильтры списка лицензий: поиск по префиксу ключа/имени/HWID и статус"""
+    now = now or datetime.utcnow()
+    
+    if search:
+        query = query.where(or_(
+            License.key.startswith(search, autoescape=True),
+            License.name.startswith(search, autoescape=True),
+            License.hwid.startswith(search, autoescape=True)
+        ))
+    
+    # Статусы совпадают с отображением в таблице админки
+    not_expired = or_(License.expiry_date.is_(None), License.expiry_date >= now)
+    if status == 'expired':
+        query = query.where(License.expiry_date < now)
+    elif status == 'inactive':
+        query = query.where(License.is_active.is_(False), not_expired)
+    elif status == 'active':
+        query = query.where(License.is_active.is_(True), License.hwid.isnot(None), not_expired)
+    elif status == 'pending':
+        query = query.where(License.is_active.is_(True), License.hwid.is_(None), not_expired)
+    
+    return query
+
+def format_local_time(utc_time):
+    """Локальное время в формате таблиц админки"""
+    if not utc_time:
+        return None
+    return get_local_time(utc_time).strftime('%Y-%m-%d %H:%M')
+
+def get_license_status(row, now):
+    if row.expiry_date and row.expiry_date < now:
+        return 'expired'
+    if not row.is_active:
+        return 'inactive'
+    if row.hwid:
+        return 'active'
+    return 'pending'
+
+@app.route('/admin/api/licenses')
+def admin_list_licenses():
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        after_id = request.args.get('after_id', type=int)
+        search = (request.args.get('q') or '').strip()
+        status = request.args.get('status')
+        
+        if status and status not in LICENSE_STATUSES:
+            return jsonify({'success': False, 'error': 'Invalid status filter'})
+        
+        now = datetime.utcnow()
+        query = db.select(
+            License.id, License.name, License.key, License.hwid, License.is_active,
+            License.expiry_date, License.activation_date
+        )
+        query = apply_license_filters(query, search, status, now)
+        
+        # Keyset-пагинация: новые лицензии первыми
+        if after_id:
+            query = query.where(License.id < after_id)
+        rows = db.session.execute(query.order_by(License.id.desc()).limit(limit + 1)).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        licenses = [{
+            'id': row.id,
+            'name': row.name,
+            'key': row.key,
+            'hwid': row.hwid,
+            'is_active': row.is_active,
+            'status': get_license_status(row, now),
+            'expiry_date': format_local_time(row.expiry_date),
+            'activation_date': format_local_time(row.activation_date)
+        } for row in rows]
+        
+        return jsonify({
+            'success': True,
+            'licenses': licenses,
+            'next_after_id': rows[-1].id if has_more else None
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Error listing licenses: {str(e)}'})
+
+ACTIVITY_GRANULARITIES = {
+    # детализация: (дней по умолчанию, максимум дней)
+    'hour': (2, ACTIVITY_HOURLY_RETENTION_DAYS),
+    'day': (30, ACTIVITY_DAILY_RETENTION_DAYS)
+}
+
+@app.route('/admin/api/licenses/<key>/activity')
+def admin_license_activity(key):
+    """Ряд событий ключа и устройства за период; читает только сводки, время в UTC"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ACTIVITY_GRANULARITIES:
+            return jsonify({'success': False, 'error': 'Invalid granularity'})
+        
+        default_days, max_days = ACTIVITY_GRANULARITIES[granularity]
+        days = min(max(request.args.get('days', default_days, type=int), 1), max_days)
+        since = datetime.utcnow() - timedelta(days=days)
+        if granularity == 'hour':
+            since = since.replace(minute=0, second=0, microsecond=0)
+        else:
+            since = since.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        conditions = (
+            LicenseActivity.key == key,
+            LicenseActivity.period == granularity,
+            LicenseActivity.bucket >= since
+        )
+        total = db.func.sum(LicenseActivity.count)
+        
+        series = {}
+        rows = db.session.execute(
+            db.select(LicenseActivity.bucket, LicenseActivity.event, total.label('count'))
+            .where(*conditions)
+            .group_by(LicenseActivity.bucket, LicenseActivity.event)
+            .order_by(LicenseActivity.bucket)
+        )
+        for row in rows:
+            point = series.setdefault(row.bucket, {'bucket': row.bucket.isoformat(), 'validate': 0, 'activate': 0, 'rejected': 0})
+            point[row.event] = int(row.count)
+        
+        devices = [{
+            'hwid': row.hwid,
+            'count': int(row.count),
+            'last_seen': row.last_bucket.isoformat()
+        } for row in db.session.execute(
+            db.select(LicenseActivity.hwid, total.label('count'), db.func.max(LicenseActivity.bucket).label('last_bucket'))
+            .where(*conditions, LicenseActivity.hwid != '')
+            .group_by(LicenseActivity.hwid)
+            .order_by(total.desc())
+        )]
+        
+        return jsonify({
+            'success': True,
+            'key': key,
+            'granularity': granularity,
+            'since': since.isoformat(),
+            'series': list(series.values()),
+            'devices': devices,
+            'distinct_devices': len(devices)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Error loading license activity: {str(e)}'})
+
 @app.route('/admin/add_license', methods=['POST'])
 def add_license():
     if not session.get('admin_logged_in'):
@@ -300,12 +1930,10 @@ def add_license():
         key = request.form.get('key')
         expiry_date_str = request.form.get('expiry_date')
         
-        print(f"DEBUG: Received expiry_date_str: {expiry_date_str}")
-        
         if not key:
             return jsonify({'success': False, 'error': 'No key provided'})
         
-        if not (len(key) == 26 and key.startswith('PFIZER-')):
+        if not is_valid_key_format(key):
             return jsonify({'success': False, 'error': 'Invalid key format. Use: PFIZER-XXXX-XXXX-XXXX-XXXX'})
         
         if License.query.filter_by(key=key).first():
@@ -314,16 +1942,10 @@ def add_license():
         expiry_date = None
         if expiry_date_str:
             try:
-                print(f"DEBUG: Processing expiry date: {expiry_date_str}")
-                
                 # Парсим локальное время (из формы в UTC+2) и конвертируем в UTC
-                local_dt = datetime.fromisoformat(expiry_date_str)
-                # Конвертируем в UTC (вычитаем 2 часа для Калининграда)
-                expiry_date = local_dt - timedelta(hours=2)
-                print(f"DEBUG: Parsed expiry_date (UTC): {expiry_date}")
-                
+                expiry_date = parse_local_datetime(expiry_date_str)
             except ValueError as e:
-                print(f"DEBUG: Error parsing date: {e}")
+                logger.debug('Invalid expiry date', extra={'fields': {'value': expiry_date_str, 'error': str(e)}})
                 return jsonify({'success': False, 'error': f'Invalid expiry date format: {str(e)}'})
         
         license_obj = License(
@@ -333,46 +1955,111 @@ def add_license():
         )
         db.session.add(license_obj)
         db.session.commit()
+        invalidate_dashboard_stats()
         
-        print(f"DEBUG: License created with expiry: {expiry_date}")
+        logger.info('License created', extra={'fields': {'key': key, 'expiry_date': expiry_date}})
         return jsonify({'success': True, 'message': 'License added successfully'})
         
     except Exception as e:
         db.session.rollback()
-        print(f"DEBUG: Exception in add_license: {e}")
+        logger.exception('Error adding license', extra={'fields': {'key': key}})
         return jsonify({'success': False, 'error': f'Error adding license: {str(e)}'})
 
+BULK_IMPORT_CHUNK = int(os.environ.get('BULK_IMPORT_CHUNK', 1000))
+MAX_REPORTED_ERRORS = 1000
+
+def iter_bulk_keys():
+    """Ключи из загруженного файла (читается построчно) или из поля формы"""
+    upload = request.files.get('file')
+    if upload:
+        for raw_line in upload.stream:
+            # CSV: ключ в первой колонке, заголовок "key" пропускаем; utf-8-sig убирает BOM из файлов Excel
+            key = raw_line.decode('utf-8-sig', 'replace').split(',')[0].strip().strip('"')
+            if key and key.lower() != 'key':
+                yield key
+    else:
+        for line in (request.form.get('keys') or '').split('\n'):
+            if line.strip():
+                yield line.strip()
+
+def insert_license_keys(keys):
+    """Вставляет пачку новых ключей, возвращает множество уже существующих"""
+    table = License.__table__
+    
+    if db.engine.dialect.name == 'postgresql':
+        stmt = (
+            pg_insert(table)
+            .values([{'key': key} for key in keys])
+            .on_conflict_do_nothing(index_elements=['key'])
+            .returning(table.c.key)
+        )
+        inserted = set(db.session.execute(stmt).scalars())
+        return set(keys) - inserted
+    
+    existing = set(db.session.execute(
+        db.select(table.c.key).where(table.c.key.in_(keys))
+    ).scalars())
+    new_keys = [key for key in keys if key not in existing]
+    if new_keys:
+        db.session.execute(table.insert(), [{'key': key} for key in new_keys])
+    return existing
+
 @app.route('/admin/bulk_add_licenses', methods=['POST'])
 def bulk_add_licenses():
     if not session.get('admin_logged_in'):
         return jsonify({'success': False, 'error': 'Not authorized'})
     
     try:
-        keys_text = request.form.get('keys')
-        if not keys_text:
-            return jsonify({'success': False, 'error': 'No keys provided'})
-        
-        keys = [k.strip() for k in keys_text.split('\n') if k.strip()]
+        started = time.perf_counter()
+        seen = set()
+        chunk = []
         added = 0
         errors = []
+        errors_total = 0
         
-        for key in keys:
-            if len(key) == 26 and key.startswith('PFIZER-'):
-                if not License.query.filter_by(key=key).first():
-                    license_obj = License(key=key)
-                    db.session.add(license_obj)
-                    added += 1
-                else:
-                    errors.append(f"Key {key} already exists")
+        def add_error(message):
+            nonlocal errors_total
+            errors_total += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(message)
+        
+        def flush_chunk():
+            nonlocal added
+            existing = insert_license_keys(chunk)
+            added += len(chunk) - len(existing)
+            for key in sorted(existing):
+                add_error(f"Key {key} already exists")
+            chunk.clear()
+        
+        for key in iter_bulk_keys():
+            if not is_valid_key_format(key):
+                add_error(f"Invalid key format: {key}")
+            elif key in seen:
+                add_error(f"Duplicate key in upload: {key}")
             else:
-                errors.append(f"Invalid key format: {key}")
+                seen.add(key)
+                chunk.append(key)
+                if len(chunk) >= BULK_IMPORT_CHUNK:
+                    flush_chunk()
+        
+        if chunk:
+            flush_chunk()
+        
+        if not seen and not errors_total:
+            return jsonify({'success': False, 'error': 'No keys provided'})
         
         db.session.commit()
+        invalidate_dashboard_stats()
+        elapsed = time.perf_counter() - started
         
         return jsonify({
             'success': True, 
             'message': f'Added {added} licenses',
-            'errors': errors
+            'added': added,
+            'errors': errors,
+            'errors_total': errors_total,
+            'elapsed_seconds': round(elapsed, 3),
+            'keys_per_second': round((len(seen) + errors_total) / elapsed) if elapsed else None
         })
     except Exception as e:
         db.session.rollback()
@@ -384,22 +2071,33 @@ def process_request(request_id):
         return jsonify({'success': False, 'error': 'Not authorized'})
     
     try:
-        # Проверяем лицензии
-        check_all_licenses_expiry()
-        
         action = request.form.get('action')
         activation_req = ActivationRequest.query.get_or_404(request_id)
         
         if action == 'approve':
-            license_obj = License.query.filter_by(key=activation_req.key).first()
-            if license_obj:
-                if is_license_expired(license_obj):
+            key = activation_req.key
+            row = db.session.execute(
+                db.select(License.hwid, License.is_active, License.expiry_date).where(License.key == key)
+            ).first()
+            if row:
+                if row.expiry_date and row.expiry_date < datetime.utcnow():
+                    if row.is_active:
+                        deactivate_expired_license(key)
                     return jsonify({'success': False, 'error': 'Cannot approve - license has expired'})
                 
-                license_obj.hwid = activation_req.hwid
-                license_obj.activation_date = datetime.utcnow()
+                # Токены прежнего устройства больше не действуют
+                if row.hwid and row.hwid != activation_req.hwid:
+                    revoke_license_tokens([key])
+                
+                db.session.execute(
+                    db.update(License)
+                    .where(License.key == key)
+                    .values(hwid=activation_req.hwid, activation_date=datetime.utcnow())
+                )
                 activation_req.status = 'approved'
                 db.session.commit()
+                license_cache.invalidate(key)
+                invalidate_dashboard_stats()
                 return jsonify({'success': True, 'message': 'Request approved'})
             else:
                 return jsonify({'success': False, 'error': 'License not found'})
@@ -407,6 +2105,7 @@ def process_request(request_id):
         elif action == 'reject':
             activation_req.status = 'rejected'
             db.session.commit()
+            invalidate_dashboard_stats()
             return jsonify({'success': True, 'message': 'Request rejected'})
         
         return jsonify({'success': False, 'error': 'Invalid action'})
@@ -420,16 +2119,17 @@ def toggle_license(license_id):
         return jsonify({'success': False, 'error': 'Not authorized'})
     
     try:
-        # Проверяем лицензии
-        check_all_licenses_expiry()
-        
         license_obj = License.query.get_or_404(license_id)
         
         if is_license_expired(license_obj) and not license_obj.is_active:
             return jsonify({'success': False, 'error': 'Cannot activate expired license'})
         
         license_obj.is_active = not license_obj.is_active
+        if not license_obj.is_active:
+            revoke_license_tokens([license_obj.key])
         db.session.commit()
+        license_cache.invalidate(license_obj.key)
+        invalidate_dashboard_stats()
         
         status = "activated" if license_obj.is_active else "deactivated"
         return jsonify({'success': True, 'message': f'License {status}'})
@@ -444,8 +2144,12 @@ def delete_license(license_id):
     
     try:
         license_obj = License.query.get_or_404(license_id)
+        key = license_obj.key
         db.session.delete(license_obj)
+        revoke_license_tokens([key])
         db.session.commit()
+        license_cache.invalidate(key)
+        invalidate_dashboard_stats()
         
         return jsonify({'success': True, 'message': 'License deleted'})
     except Exception as e:
@@ -472,9 +2176,7 @@ def renew_license(license_id):
         
         # Парсим новую дату и конвертируем в UTC
         try:
-            local_dt = datetime.fromisoformat(new_expiry_str)
-            new_expiry_date = local_dt - timedelta(hours=2)  # Конвертируем в UTC
-            print(f"DEBUG: New expiry date (UTC): {new_expiry_date}")
+            new_expiry_date = parse_local_datetime(new_expiry_str)
         except ValueError as e:
             return jsonify({'success': False, 'error': f'Invalid expiry date format: {str(e)}'})
         
@@ -487,6 +2189,9 @@ def renew_license(license_id):
         license_obj.is_active = True
         
         db.session.commit()
+        license_cache.invalidate(license_obj.key)
+        invalidate_dashboard_stats()
+        logger.info('License renewed', extra={'fields': {'key': license_obj.key, 'expiry_date': new_expiry_date}})
         
         return jsonify({
             'success': True, 
@@ -498,6 +2203,98 @@ def renew_license(license_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': f'Error renewing license: {str(e)}'})
 
+BULK_OPERATIONS = ('renew', 'activate', 'deactivate', 'delete')
+BULK_FILTER_FIELDS = ('name', 'key_prefix', 'expiry_from', 'expiry_to', 'q', 'status')
+
+def apply_bulk_selection(stmt, data):
+    """Выбор лицензий для массовой операции: список ids или фильтр"""
+    ids = data.get('ids')
+    if ids:
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            raise ValueError('ids must be a list of integers')
+        return stmt.where(License.id.in_(ids))
+    
+    filters = data.get('filter') or {}
+    if not isinstance(filters, dict) or not any(filters.get(field) for field in BULK_FILTER_FIELDS):
+        # Без условий операция затронула бы все лицензии
+        raise ValueError('Provide ids or at least one filter')
+    
+    if filters.get('status') and filters['status'] not in LICENSE_STATUSES:
+        raise ValueError('Invalid status filter')
+    
+    if filters.get('name'):
+        stmt = stmt.where(License.name == filters['name'])
+    if filters.get('key_prefix'):
+        stmt = stmt.where(License.key.startswith(filters['key_prefix'], autoescape=True))
+    if filters.get('expiry_from'):
+        stmt = stmt.where(License.expiry_date >= parse_local_datetime(filters['expiry_from']))
+    if filters.get('expiry_to'):
+        stmt = stmt.where(License.expiry_date < parse_local_datetime(filters['expiry_to']))
+    return apply_license_filters(stmt, (filters.get('q') or '').strip(), filters.get('status'))
+
+@app.route('/admin/bulk/<operation>', methods=['POST'])
+def bulk_license_operation(operation):
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    if operation not in BULK_OPERATIONS:
+        return jsonify({'success': False, 'error': 'Invalid bulk operation'})
+    
+    try:
+        data = request.get_json() or {}
+        now = datetime.utcnow()
+        
+        if operation == 'renew':
+            new_expiry_str = data.get('new_expiry_date')
+            if not new_expiry_str:
+                return jsonify({'success': False, 'error': 'No new expiry date provided'})
+            new_expiry_date = parse_local_datetime(new_expiry_str)
+            if new_expiry_date <= now:
+                return jsonify({'success': False, 'error': 'New expiry date must be in the future'})
+            
+            # Как в renew_license: сохраняем исходную дату при первом продлении
+            stmt = apply_bulk_selection(db.update(License), data).values(
+                original_expiry_date=db.func.coalesce(License.original_expiry_date, License.expiry_date),
+                expiry_date=new_expiry_date,
+                is_active=True
+            )
+        elif operation == 'activate':
+            # Истекшие лицензии активировать нельзя
+            stmt = apply_bulk_selection(db.update(License), data).where(
+                License.is_active.is_(False),
+                or_(License.expiry_date.is_(None), License.expiry_date >= now)
+            ).values(is_active=True)
+        else:
+            selection = apply_bulk_selection(db.select(License.key), data)
+            if operation == 'deactivate':
+                selection = selection.where(License.is_active.is_(True))
+            revoke_license_tokens(list(db.session.execute(selection).scalars()))
+            
+            if operation == 'deactivate':
+                stmt = apply_bulk_selection(db.update(License), data).where(
+                    License.is_active.is_(True)
+                ).values(is_active=False)
+            else:
+                stmt = apply_bulk_selection(db.delete(License), data)
+        
+        affected = db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        
+        license_cache.clear()
+        invalidate_dashboard_stats()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Bulk {operation}: {affected} licenses affected',
+            'affected': affected
+        })
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error in bulk {operation}: {str(e)}'})
+
 # Специальный endpoint для принудительной проверки
 @app.route('/admin/check_expired', methods=['POST'])
 def check_expired():
@@ -505,8 +2302,115 @@ def check_expired():
         return jsonify({'success': False, 'error': 'Not authorized'})
     
     expired_count = check_all_licenses_expiry()
+    invalidate_dashboard_stats()
     return jsonify({'success': True, 'message': f'Checked licenses. Deactivated: {expired_count}'})
 
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+def parse_date_range_filters(query, column_attr, prefix):
+    """Фильтры <prefix>_from / <prefix>_to (локальное время, как в формах админки)"""
+    for suffix, compare in (('from', column_attr.__ge__), ('to', column_attr.__lt__)):
+        value = request.args.get(f'{prefix}_{suffix}')
+        if value:
+            query = query.where(compare(parse_local_datetime(value)))
+    return query
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def stream_export(query, filename, export_format):
+    """Потоковая выгрузка в CSV или NDJSON с серверным курсором"""
+    def generate():
+        result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        columns = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        
+        if export_format == 'csv':
+            writer.writerow(columns)
+        
+        for partition in result.partitions():
+            for row in partition:
+                if export_format == 'csv':
+                    writer.writerow([export_value(value) for value in row])
+                else:
+                    record = {name: export_value(value) for name, value in zip(columns, row)}
+                    buffer.write(json.dumps(record, ensure_ascii=False) + '\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        
+        if buffer.tell():
+            yield buffer.getvalue()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}.{extension}'}
+    )
+
+@app.route('/admin/export/licenses')
+def export_licenses():
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    try:
+        export_format = request.args.get('format', 'csv')
+        status = request.args.get('status')
+        if export_format not in ('csv', 'ndjson'):
+            return jsonify({'success': False, 'error': 'Invalid export format'})
+        if status and status not in LICENSE_STATUSES:
+            return jsonify({'success': False, 'error': 'Invalid status filter'})
+        
+        query = db.select(
+            License.id, License.name, License.key, License.hwid, License.is_active,
+            License.activation_date, License.created_at, License.last_validation,
+            License.expiry_date, License.original_expiry_date
+        )
+        query = apply_license_filters(query, (request.args.get('q') or '').strip(), status)
+        query = parse_date_range_filters(query, License.expiry_date, 'expiry')
+        query = parse_date_range_filters(query, License.created_at, 'created')
+        
+        return stream_export(query.order_by(License.id), 'licenses', export_format)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid date format: {str(e)}'})
+
+@app.route('/admin/export/activation_requests')
+def export_activation_requests():
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            return jsonify({'success': False, 'error': 'Invalid export format'})
+        
+        query = db.select(
+            ActivationRequest.id, ActivationRequest.key, ActivationRequest.hwid,
+            ActivationRequest.ip_address, ActivationRequest.user_agent, ActivationRequest.status,
+            ActivationRequest.attempts, ActivationRequest.created_at, ActivationRequest.last_seen
+        )
+        if request.args.get('status'):
+            query = query.where(ActivationRequest.status == request.args['status'])
+        if request.args.get('key'):
+            query = query.where(ActivationRequest.key == request.args['key'])
+        query = parse_date_range_filters(query, ActivationRequest.created_at, 'created')
+        
+        return stream_export(query.order_by(ActivationRequest.id), 'activation_requests', export_format)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid date format: {str(e)}'})
+
+@app.route('/admin/cache_stats')
+def cache_stats():
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Not authorized'})
+    
+    return jsonify({'success': True, 'cache': license_cache.stats()})
+
 
 
 @app.route('/license/info', methods=['POST'])
@@ -519,26 +2423,38 @@ def license_info():
         key = data.get('key')
         hwid = data.get('hwid')
         
+        limited = rate_limit_response(key)
+        if limited:
+            return limited
+        
         if not key:
             return jsonify({'success': False, 'error': 'No key provided'})
         
-        license_obj = License.query.filter_by(key=key).first()
+        stmt = db.select(
+            License.key, License.name, License.hwid, License.is_active,
+            License.activation_date, License.expiry_date, License.created_at
+        ).where(License.key == key)
+        row = next(iter(read_all(stmt)), None)
         
-        if not license_obj:
+        # Реплика может отставать: отрицательный ответ перепроверяем на основной базе
+        if DATABASE_READ_URL and (not row or (row.hwid and row.hwid != hwid)):
+            row = db.session.execute(stmt).first()
+        
+        if not row:
             return jsonify({'success': False, 'error': 'Invalid license key'})
         
         # Проверяем HWID
-        if license_obj.hwid and license_obj.hwid != hwid:
+        if row.hwid and row.hwid != hwid:
             return jsonify({'success': False, 'error': 'License not valid for this device'})
         
         # Форматируем информацию о лицензии
         license_data = {
-            'key': license_obj.key,
-            'name': license_obj.name,
-            'is_active': license_obj.is_active,
-            'activation_date': license_obj.activation_date.isoformat() if license_obj.activation_date else None,
-            'expiry_date': license_obj.expiry_date.isoformat() if license_obj.expiry_date else None,
-            'created_at': license_obj.created_at.isoformat() if license_obj.created_at else None
+            'key': row.key,
+            'name': row.name,
+            'is_active': row.is_active,
+            'activation_date': row.activation_date.isoformat() if row.activation_date else None,
+            'expiry_date': row.expiry_date.isoformat() if row.expiry_date else None,
+            'created_at': row.created_at.isoformat() if row.created_at else None
         }
         
         return jsonify({'success': True, 'license_data': license_data})
@@ -549,6 +2465,54 @@ def license_info():
 
 
 
+@app.route('/license/token/verify', methods=['POST'])
+def license_token_verify():
+    """Проверка офлайн-токена для клиентов без секрета подписи"""
+    try:
+        limited = rate_limit_response()
+        if limited:
+            return limited
+        
+        data = request.get_json()
+        if not data or not data.get('token'):
+            return jsonify({'valid': False, 'error': 'No token provided'})
+        
+        payload = verify_license_token(data['token'], data.get('hwid'))
+        if not payload:
+            return jsonify({'valid': False, 'error': 'Invalid or expired token'})
+        
+        issued_at = datetime.utcfromtimestamp(payload['i'])
+        revoked = db.session.execute(
+            db.select(TokenRevocation.id)
+            .where(TokenRevocation.key == payload['k'], TokenRevocation.revoked_at >= issued_at)
+            .limit(1)
+        ).first()
+        if revoked:
+            return jsonify({'valid': False, 'error': 'Token has been revoked'})
+        
+        return jsonify({'valid': True, 'expires_at': payload['e']})
+    except Exception as e:
+        return jsonify({'valid': False, 'error': f'Token verification error: {str(e)}'})
+
+@app.route('/license/revocations')
+def license_revocations():
+    """Список отзывов для релеев: хэши ключей и время отзыва (unix time)"""
+    try:
+        since = request.args.get('since', 0, type=float)
+        rows = db.session.execute(
+            db.select(TokenRevocation.key, TokenRevocation.revoked_at)
+            .where(TokenRevocation.revoked_at >= datetime.utcfromtimestamp(since))
+            .order_by(TokenRevocation.revoked_at)
+        )
+        revoked = [{
+            'key_hash': hash_license_key(row.key),
+            'revoked_at': row.revoked_at.replace(tzinfo=timezone.utc).timestamp()
+        } for row in rows]
+        
+        return jsonify({'success': True, 'revoked': revoked, 'server_time': time.time()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Server error: {str(e)}'})
+
 @app.route('/')
 def index():
     return jsonify({
@@ -562,6 +2526,17 @@ def index():
 def health():
     return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
 
+@app.route('/metrics')
+def metrics_endpoint():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return 'Not authorized', 401
+    
+    snapshots = [collect_process_metrics()] + load_worker_snapshots()
+    return render_metrics(snapshots), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
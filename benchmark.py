@@ -0,0 +1,630 @@
+"""Нагрузочный бенчмарк API лицензий.
+
+Заполняет базу тестовыми лицензиями и запросами на активацию, прогоняет
+сценарии через тестовый клиент Flask с заданной конкурентностью и сохраняет
+пропускную способность, перцентили задержек и число SQL-запросов в JSON.
+
+    python benchmark.py --licenses 10000 --requests 5000 --concurrency 8
+    python benchmark.py --compare benchmark-old.json
+    python benchmark.py --gunicorn-workers sync,gthread
+    python benchmark.py --scenarios '' --import-keys 10000,100000,1000000
+    python benchmark.py --base-url http://127.0.0.1:8000 --database-url postgresql://...
+
+По умолчанию используется временная база SQLite. Для Postgres передайте
+--database-url с пустой одноразовой базой: таблицы будут созданы и заполнены.
+
+По умолчанию запросы идут через тестовый клиент в том же процессе. С --gunicorn-workers
+для каждого класса воркеров запускается gunicorn (gunicorn.conf.py) на заполненной
+базе, и сценарии идут по HTTP - так сравниваются sync и gthread. --base-url направляет
+запросы на уже запущенный сервер; он должен работать с той же базой и ADMIN_PASSWORD.
+Число запросов к базе по HTTP берется из заголовка Server-Timing (SQL_PROFILE=1).
+"""
+import argparse
+import http.client
+import io
+import itertools
+import json
+import math
+import os
+import shutil
+import socket
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from json import dumps as json_dumps
+from urllib.parse import urlencode, urlsplit
+
+SCENARIOS = ('activate', 'validate', 'batch', 'info', 'dashboard', 'admin_licenses')
+BATCH_ITEMS = 50
+ADMIN_PASSWORD = 'benchmark-admin'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Бенчмарк API лицензий')
+    parser.add_argument('--database-url', help='по умолчанию временная база SQLite')
+    parser.add_argument('--licenses', type=int, default=2000, help='число лицензий в базе')
+    parser.add_argument('--activation-requests', type=int, default=500, help='число ожидающих запросов на активацию')
+    parser.add_argument('--requests', type=int, default=2000, help='число запросов в каждом сценарии')
+    parser.add_argument('--concurrency', type=int, default=8, help='число параллельных потоков')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='сценарии через запятую')
+    parser.add_argument('--warmup', type=int, default=50, help='число прогревочных запросов на сценарий')
+    parser.add_argument('--micro-iterations', type=int, default=20000, help='итераций в микробенчмарках, 0 - пропустить')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark.json', help='файл для результатов')
+    parser.add_argument('--compare', help='JSON предыдущего запуска для сравнения')
+    parser.add_argument('--import-keys', default='',
+                        help='размеры массового импорта ключей через загрузку CSV, например 10000,100000')
+    parser.add_argument('--base-url', help='адрес уже запущенного сервера вместо тестового клиента')
+    parser.add_argument('--gunicorn-workers', default='',
+                        help='классы воркеров gunicorn для сравнения по HTTP, например sync,gthread')
+    parser.add_argument('--workers', type=int, default=2, help='число процессов gunicorn')
+    parser.add_argument('--threads', type=int, default=8, help='потоков на воркер gthread')
+    parser.add_argument('--max-queries', default='',
+                        help='бюджет запросов к базе на запрос, например validate=1,info=1; '
+                             'при превышении код возврата 1')
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    """Окружение задается до импорта app.py: он читает настройки при импорте"""
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ['DISABLE_SCHEDULER'] = '1'
+    os.environ['RATE_LIMIT_BACKEND'] = 'memory'
+    # Лимиты запросов исказили бы измерения
+    os.environ['RATE_LIMIT_PER_IP'] = ''
+    os.environ['RATE_LIMIT_PER_KEY'] = ''
+    os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    # Журнал каждого запроса не нужен в выводе бенчмарка
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Пароль администратора для входа по HTTP (при создании базы бенчмарком)
+    os.environ.setdefault('ADMIN_PASSWORD', ADMIN_PASSWORD)
+
+
+def make_key(i):
+    digits = f'{i:016X}'
+    return 'PFIZER-' + '-'.join(digits[j:j + 4] for j in range(0, 16, 4))
+
+
+def seed_database(app_module, args):
+    """Половина лицензий активирована на устройство HWID-<i>, половина свободна"""
+    db, License, ActivationRequest = app_module.db, app_module.License, app_module.ActivationRequest
+    now = datetime.utcnow()
+
+    with app_module.app.app_context():
+        # Старые версии app.py (для сравнения с ними) создавали схему без init_db
+        if hasattr(app_module, 'init_db'):
+            app_module.init_db()
+        else:
+            db.create_all()
+        if db.session.execute(db.select(db.func.count()).select_from(License)).scalar():
+            sys.exit('❌ База уже содержит лицензии, нужна пустая база')
+
+        licenses = []
+        for i in range(args.licenses):
+            activated = i % 2 == 0
+            licenses.append({
+                'key': make_key(i),
+                'name': f'Benchmark {i}',
+                'hwid': f'HWID-{i}' if activated else None,
+                'is_active': True,
+                'activation_date': now if activated else None,
+                'expiry_date': now + timedelta(days=30),
+                'created_at': now
+            })
+        for start in range(0, len(licenses), 1000):
+            db.session.execute(db.insert(License), licenses[start:start + 1000])
+
+        requests = [{
+            'key': make_key((i * 2) % args.licenses),
+            'hwid': f'OTHER-{i}',
+            'ip_address': '127.0.0.1',
+            'user_agent': 'benchmark',
+            'status': 'pending',
+            'attempts': 1,
+            'created_at': now,
+            'last_seen': now
+        } for i in range(min(args.activation_requests, args.licenses))]
+        columns = set(ActivationRequest.__table__.columns.keys())
+        requests = [{name: value for name, value in row.items() if name in columns} for row in requests]
+        if requests:
+            db.session.execute(db.insert(ActivationRequest), requests)
+        db.session.commit()
+
+    activated = [(make_key(i), f'HWID-{i}') for i in range(0, args.licenses, 2)]
+    free = [(make_key(i), f'NEW-{i}') for i in range(1, args.licenses, 2)]
+    return activated, free
+
+
+def build_scenarios(activated, free):
+    """Сценарий - функция (клиент, rng, номер запроса) -> ответ"""
+    def activate(client, rng, n):
+        # Первые проходы активируют свободные ключи, дальше - повторная активация
+        key, hwid = free[n % len(free)]
+        return client.post('/license', json={'action': 'activate', 'key': key, 'hwid': hwid})
+
+    def validate(client, rng, n):
+        key, hwid = rng.choice(activated)
+        return client.post('/license', json={'action': 'validate', 'key': key, 'hwid': hwid})
+
+    def batch(client, rng, n):
+        items = [{'key': key, 'hwid': hwid} for key, hwid in rng.sample(activated, min(BATCH_ITEMS, len(activated)))]
+        return client.post('/license/batch', json={'items': items})
+
+    def info(client, rng, n):
+        key, hwid = rng.choice(activated)
+        return client.post('/license/info', json={'key': key, 'hwid': hwid})
+
+    def dashboard(client, rng, n):
+        return client.get('/admin/')
+
+    def admin_licenses(client, rng, n):
+        return client.get('/admin/api/licenses')
+
+    return {
+        'activate': activate,
+        'validate': validate,
+        'batch': batch,
+        'info': info,
+        'dashboard': dashboard,
+        'admin_licenses': admin_licenses
+    }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Метод ближайшего ранга
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s['latency'] * 1000 for s in samples)
+    queries = [s['queries'] for s in samples if s['queries'] is not None]
+    db_times = [s['db_time'] for s in samples if s['db_time'] is not None]
+    statuses = {}
+    for s in samples:
+        statuses[str(s['status'])] = statuses.get(str(s['status']), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s['status'] >= 400),
+        'statuses': statuses,
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3)
+        },
+        'db_queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries)
+        } if queries else None,
+        'db_time_ms_per_request': round(sum(db_times) / len(db_times) * 1000, 3) if db_times else None
+    }
+
+
+class HttpResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class HttpClient:
+    """Клиент с постоянным соединением и тем же интерфейсом, что у тестового клиента Flask"""
+
+    def __init__(self, base_url, cookie=None):
+        url = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        self.cookie = cookie
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Сервер закрыл keep-alive соединение - повторяем на новом
+            self.connection.close()
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        response.read()
+        return HttpResponse(response.status, response.headers)
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, json=None, data=None):
+        if data is not None:
+            return self.request('POST', path, urlencode(data), 'application/x-www-form-urlencoded')
+        return self.request('POST', path, json_dumps(json), 'application/json')
+
+
+def login_cookie(base_url):
+    """Сессионная cookie администратора для сценариев админки"""
+    client = HttpClient(base_url)
+    client.connection.request('POST', '/admin/login',
+                              body=urlencode({'username': 'admin', 'password': os.environ['ADMIN_PASSWORD']}),
+                              headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = client.connection.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie')
+    if response.status != 302 or not cookie:
+        sys.exit('❌ Не удалось войти в админку: проверьте ADMIN_PASSWORD сервера')
+    return cookie.split(';', 1)[0]
+
+
+def server_timing_stats(response):
+    """Запросы к базе из заголовка Server-Timing (db;dur=1.23;desc="2 queries")"""
+    header = response.headers.get('Server-Timing', '')
+    if not header.startswith('db;'):
+        return {'queries': None, 'db_time': None}
+    parts = dict(part.split('=', 1) for part in header.split(';')[1:])
+    return {'queries': int(parts['desc'].strip('"').split()[0]), 'db_time': float(parts['dur']) / 1000}
+
+
+def run_scenario(name, scenario, args, make_client, request_stats):
+    local = threading.local()
+    # Номер потока вместо его идентификатора - выборка ключей повторяется между запусками
+    thread_numbers = itertools.count()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = make_client()
+            local.rng = random.Random(f'{args.seed}-{name}-{next(thread_numbers)}')
+        return local.client
+
+    def call(n):
+        c = client()
+        started = time.perf_counter()
+        response = scenario(c, local.rng, n)
+        latency = time.perf_counter() - started
+        stats = request_stats(response)
+        return {'latency': latency, 'status': response.status_code,
+                'queries': stats['queries'], 'db_time': stats['db_time']}
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(call, range(args.warmup)))
+        started = time.perf_counter()
+        samples = list(pool.map(call, range(args.warmup, args.warmup + args.requests)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(samples, elapsed)
+
+
+def measure(fn, iterations):
+    """Пропускная способность по стенным часам и процессорное время на вызов"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    for i in range(iterations):
+        fn(i)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / wall),
+        'cpu_us_per_call': round(cpu / iterations * 1e6, 2)
+    }
+
+
+def run_micro_benchmarks(app_module, args, activated):
+    """Подпись токенов и поиск лицензии: полный ORM-объект против выборки колонок"""
+    results = {}
+    iterations = args.micro_iterations
+    if not iterations:
+        return results
+
+    expiry = datetime.utcnow() + timedelta(days=30)
+    token = app_module.issue_license_token('PFIZER-0000-0000-0000-0000', 'HWID-0', expiry)
+    results['token_sign'] = measure(
+        lambda i: app_module.issue_license_token('PFIZER-0000-0000-0000-0000', 'HWID-0', expiry), iterations)
+    results['token_verify'] = measure(lambda i: app_module.verify_license_token(token, 'HWID-0'), iterations)
+
+    db, License = app_module.db, app_module.License
+    # Откат после каждого вызова - как завершение сессии в конце HTTP-запроса
+    def orm_lookup(i):
+        key, hwid = activated[i % len(activated)]
+        license_obj = License.query.filter_by(key=key).first()
+        if not app_module.is_license_expired(license_obj):
+            app_module.get_validation_error(
+                {'hwid': license_obj.hwid, 'is_active': license_obj.is_active}, hwid)
+        db.session.rollback()
+
+    def lean_lookup(i):
+        key, hwid = activated[i % len(activated)]
+        row = db.session.execute(
+            db.select(License.hwid, License.is_active, License.expiry_date).where(License.key == key)
+        ).first()
+        if not (row.expiry_date and row.expiry_date < datetime.utcnow()):
+            app_module.get_validation_error(row._mapping, hwid)
+        db.session.rollback()
+
+    lookups = min(iterations, 5000)
+    with app_module.app.app_context():
+        results['lookup_orm'] = measure(orm_lookup, lookups)
+        results['lookup_lean'] = measure(lean_lookup, lookups)
+
+    return results
+
+
+def run_import_benchmarks(app_module, sizes):
+    """Массовый импорт: CSV загружается файлом, как из админки, в пустой диапазон ключей"""
+    results = {}
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['admin_logged_in'] = True
+
+    # Диапазон ключей не пересекается с заполненными лицензиями
+    offset = 1 << 40
+    for size in sizes:
+        content = io.BytesIO()
+        content.write(b'key\r\n')
+        for i in range(offset, offset + size):
+            content.write(make_key(i).encode() + b'\r\n')
+        offset += size
+        content.seek(0)
+
+        print(f"📥 Импорт {size} ключей")
+        started = time.perf_counter()
+        response = client.post('/admin/bulk_add_licenses', data={'file': (content, 'keys.csv')},
+                               content_type='multipart/form-data')
+        elapsed = time.perf_counter() - started
+        data = response.get_json()
+        if not data.get('success'):
+            sys.exit(f"❌ Импорт не удался: {data.get('error')}")
+        results[str(size)] = {
+            'keys': size,
+            'added': data['added'],
+            'seconds': round(elapsed, 3),
+            # С учетом загрузки и разбора файла, а не только записи в базу
+            'keys_per_second': round(size / elapsed),
+            'server_keys_per_second': data['keys_per_second']
+        }
+    return results
+
+
+def parse_query_budgets(value):
+    budgets = {}
+    for item in filter(None, value.split(',')):
+        name, limit = item.split('=')
+        budgets[name.strip()] = int(limit)
+    return budgets
+
+
+def check_query_budgets(results, budgets):
+    """Сценарии, в которых хотя бы один запрос превысил бюджет запросов к базе"""
+    violations = []
+    for name, limit in budgets.items():
+        scenario = results['scenarios'].get(name)
+        if scenario and scenario['db_queries_per_request'] and scenario['db_queries_per_request']['max'] > limit:
+            violations.append(f"{name}: {scenario['db_queries_per_request']['max']} queries, budget {limit}")
+    return violations
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_scenarios(scenarios):
+    print(f"{'scenario':<16}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'errors':>8}")
+    for name, r in scenarios.items():
+        lat = r['latency_ms']
+        queries = r['db_queries_per_request']['mean'] if r['db_queries_per_request'] else '-'
+        print(f"{name:<16}{r['throughput_rps']:>10}{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}"
+              f"{queries:>9}{r['errors']:>8}")
+
+
+def compare_scenarios(scenarios, old_scenarios):
+    for name, r in scenarios.items():
+        old = old_scenarios.get(name)
+        if not old:
+            continue
+        rps = (r['throughput_rps'] / old['throughput_rps'] - 1) * 100
+        p95 = (r['latency_ms']['p95'] / old['latency_ms']['p95'] - 1) * 100
+        queries = ''
+        if r['db_queries_per_request'] and old['db_queries_per_request']:
+            queries = f"queries {old['db_queries_per_request']['mean']} -> {r['db_queries_per_request']['mean']}"
+        print(f"{name:<16}rps {rps:+.1f}%  p95 {p95:+.1f}%  {queries}")
+
+
+def print_report(results, baseline=None):
+    if results['scenarios']:
+        print()
+        print_scenarios(results['scenarios'])
+    for worker_class, server in results['servers'].items():
+        print(f"\ngunicorn {worker_class}: {server['workers']} воркеров x {server['threads']} потоков")
+        print_scenarios(server['scenarios'])
+    for size, r in results['import'].items():
+        print(f"{'import ' + size:<16}{r['keys_per_second']:>10} keys/s{r['seconds']:>10} s")
+    for name, r in results['micro'].items():
+        print(f"{name:<16}{r['ops_per_sec']:>10} ops/s{r['cpu_us_per_call']:>10} us CPU/call")
+
+    if not baseline:
+        return
+    print(f"\nСравнение с {baseline['meta'].get('revision')}:")
+    compare_scenarios(results['scenarios'], baseline.get('scenarios', {}))
+    for worker_class, server in results['servers'].items():
+        old = baseline.get('servers', {}).get(worker_class)
+        if old:
+            print(f"gunicorn {worker_class}:")
+            compare_scenarios(server['scenarios'], old['scenarios'])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(worker_class, args):
+    """Запускает gunicorn с настройками из gunicorn.conf.py на заполненной базе"""
+    port = free_port()
+    threads = args.threads if worker_class == 'gthread' else 1
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=worker_class,
+        WEB_CONCURRENCY=str(args.workers),
+        # Sync-воркер с threads > 1 gunicorn сам заменяет на gthread
+        GUNICORN_THREADS=str(threads),
+        SKIP_DB_UPGRADE='1',
+        SQL_PROFILE='1'
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'❌ gunicorn ({worker_class}) завершился при запуске')
+        try:
+            if HttpClient(base_url).get('/health').status_code == 200:
+                return process, base_url, threads
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    sys.exit(f'❌ gunicorn ({worker_class}) не ответил за 30 секунд')
+
+
+def run_scenarios(names, scenarios, args, make_client, request_stats):
+    results = {}
+    for name in names:
+        print(f"🚀 {name}: {args.requests} запросов, {args.concurrency} потоков")
+        results[name] = run_scenario(name, scenarios[name], args, make_client, request_stats)
+    return results
+
+
+def main():
+    args = parse_args()
+    budgets = parse_query_budgets(args.max_queries)
+    workdir = tempfile.mkdtemp(prefix='license-benchmark-')
+    configure_environment(args, workdir)
+
+    import app as app_module
+    from flask import g
+
+    # Число запросов к базе уже считается в g хуками движка в app.py;
+    # в старых версиях без этих хуков считаем сами (для сравнения с ними)
+    request_stats = threading.local()
+    if not hasattr(app_module, '_after_cursor_execute'):
+        from flask import has_request_context
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        @event.listens_for(Engine, 'after_cursor_execute')
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                g.db_queries = g.get('db_queries', 0) + 1
+
+    @app_module.app.after_request
+    def capture_db_stats(response):
+        request_stats.last = {'queries': g.get('db_queries', 0), 'db_time': g.get('db_time', 0.0)}
+        return response
+
+    print(f"📦 Заполнение базы: {args.licenses} лицензий, {args.activation_requests} запросов на активацию")
+    activated, free = seed_database(app_module, args)
+    scenarios = build_scenarios(activated, free)
+
+    database_kind = os.environ['DATABASE_URL'].split(':', 1)[0]
+    worker_classes = [name.strip() for name in args.gunicorn_workers.split(',') if name.strip()]
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'database': database_kind,
+            'mode': 'gunicorn' if worker_classes else ('http' if args.base_url else 'test_client'),
+            'licenses': args.licenses,
+            'activation_requests': args.activation_requests,
+            'requests': args.requests,
+            'concurrency': args.concurrency
+        },
+        'scenarios': {},
+        'servers': {},
+        'import': {},
+        'micro': {}
+    }
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in names:
+        if name not in scenarios:
+            sys.exit(f'❌ Неизвестный сценарий: {name}')
+
+    if worker_classes:
+        # Каждый сервер начинает с одинаковой базы: активации меняют ее состояние
+        snapshot = None
+        if database_kind == 'sqlite':
+            with app_module.app.app_context():
+                database_path = app_module.db.engine.url.database
+                app_module.db.engine.dispose()
+            snapshot = f'{database_path}.seed'
+            shutil.copyfile(database_path, snapshot)
+        for worker_class in worker_classes:
+            if snapshot:
+                shutil.copyfile(snapshot, database_path)
+            process, base_url, threads = start_gunicorn(worker_class, args)
+            try:
+                cookie = login_cookie(base_url)
+                results['servers'][worker_class] = {
+                    'workers': args.workers,
+                    'threads': threads,
+                    'scenarios': run_scenarios(names, scenarios, args,
+                                               lambda: HttpClient(base_url, cookie), server_timing_stats)
+                }
+            finally:
+                process.terminate()
+                process.wait()
+    elif args.base_url:
+        cookie = login_cookie(args.base_url)
+        results['scenarios'] = run_scenarios(names, scenarios, args,
+                                             lambda: HttpClient(args.base_url, cookie), server_timing_stats)
+    else:
+        def make_test_client():
+            client = app_module.app.test_client()
+            with client.session_transaction() as sess:
+                sess['admin_logged_in'] = True
+            return client
+        results['scenarios'] = run_scenarios(names, scenarios, args, make_test_client,
+                                             lambda response: request_stats.last)
+
+    import_sizes = [int(size) for size in args.import_keys.split(',') if size.strip()]
+    if import_sizes:
+        results['import'] = run_import_benchmarks(app_module, import_sizes)
+
+    results['micro'] = run_micro_benchmarks(app_module, args, activated)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"\n✅ Результаты сохранены в {args.output}")
+
+    violations = check_query_budgets(results, budgets)
+    if violations:
+        for violation in violations:
+            print(f"❌ Превышен бюджет запросов - {violation}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
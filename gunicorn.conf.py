@@ -0,0 +1,36 @@
+# Настройки gunicorn (подхватываются автоматически из текущей директории)
+import os
+import subprocess
+import sys
+
+# Потоковые воркеры: запрос, ожидающий ответа базы, занимает поток, а не весь воркер.
+# Размер пула соединений в app.py по умолчанию равен числу потоков.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Импорт приложения один раз в мастере; при импорте app.py к базе не обращается,
+# а соединения и планировщик поднимаются в каждом воркере в post_fork
+preload_app = os.environ.get('GUNICORN_PRELOAD') == '1'
+
+
+def on_starting(server):
+    """Миграции и начальные данные один раз в отдельном процессе, до запуска воркеров"""
+    if os.environ.get('SKIP_DB_UPGRADE') == '1':
+        return
+    env = dict(os.environ, DISABLE_SCHEDULER='1')
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], env=env, check=True)
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker()
+
+
+def worker_exit(server, worker):
+    """Сбрасывает отложенные отметки last_validation и события лицензий при остановке воркера"""
+    from app import flush_activity, flush_heartbeats
+    flush_heartbeats()
+    flush_activity()
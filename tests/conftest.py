@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+import pytest
+
+# app.py читает настройки при импорте: отдельная база, без планировщика и лимитов
+_workdir = tempfile.mkdtemp(prefix='license-server-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ['DISABLE_SCHEDULER'] = '1'
+os.environ['RATE_LIMIT_BACKEND'] = 'memory'
+os.environ['RATE_LIMIT_PER_IP'] = ''
+os.environ['RATE_LIMIT_PER_KEY'] = ''
+os.environ['METRICS_DIR'] = os.path.join(_workdir, 'metrics')
+os.environ['LOG_LEVEL'] = 'WARNING'
+
+import app as app_module  # noqa: E402
+
+with app_module.app.app_context():
+    app_module.init_db()
+
+
+@pytest.fixture
+def app():
+    yield app_module.app
+    with app_module.app.app_context():
+        for model in (app_module.License, app_module.ActivationRequest,
+                      app_module.TokenRevocation, app_module.LicenseActivity):
+            model.query.delete()
+        app_module.db.session.commit()
+    app_module.license_cache.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['admin_logged_in'] = True
+    return client
+
+
+@pytest.fixture
+def license_factory(app):
+    def create(key='PFIZER-AAAA-BBBB-CCCC-DDDD', hwid='HWID-1', days=30):
+        from datetime import datetime, timedelta
+        with app.app_context():
+            license_obj = app_module.License(key=key, hwid=hwid, is_active=True,
+                                             expiry_date=datetime.utcnow() + timedelta(days=days))
+            app_module.db.session.add(license_obj)
+            app_module.db.session.commit()
+            return license_obj.id
+    return create
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import app as app_module
+
+KEY = 'PFIZER-AAAA-BBBB-CCCC-DDDD'
+
+
+def test_client_hwid_is_normalized(client, license_factory):
+    license_factory()
+    for hwid in ({'a': 1}, ['x'], 'x' * 300, 'bad\x00hwid'):
+        result = client.post('/license', json={'action': 'validate', 'key': KEY, 'hwid': hwid}).get_json()
+        assert result == {'valid': False, 'error': 'License not valid for this device'}
+
+    result = client.post('/license/batch', json={'items': [{'key': KEY, 'hwid': {'a': 1}}, {'key': ['x']}]}).get_json()
+    assert [item['valid'] for item in result['results']] == [False, False]
+
+    with app_module.app.app_context():
+        assert app_module.activity_buffer.flush() > 0
+        hwids = {row.hwid for row in app_module.LicenseActivity.query.all()}
+    assert 'x' * 255 in hwids
+    assert 'badhwid' in hwids
+
+
+def test_failing_entry_is_dropped_after_retries(app, monkeypatch):
+    buffer = app_module.ActivityBuffer(max_pending=100)
+    now = datetime.utcnow()
+    buffer.record(KEY, 'validate', 'good', now)
+    buffer.record(KEY, 'validate', 'bad', now)
+
+    upsert = app_module.ActivityBuffer._upsert
+
+    def failing_upsert(rows):
+        if any(row_id[4] == 'bad' for row_id in rows):
+            raise ValueError('bad row')
+        upsert(rows)
+
+    monkeypatch.setattr(app_module.ActivityBuffer, '_upsert', staticmethod(failing_upsert))
+    with app.app_context():
+        assert buffer.flush() == 2
+        for _ in range(app_module.ACTIVITY_MAX_RETRIES):
+            buffer.flush()
+        assert buffer.pending() == 0
+        assert {row.hwid for row in app_module.LicenseActivity.query.all()} == {'good'}
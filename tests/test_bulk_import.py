@@ -0,0 +1,12 @@
+import io
+
+
+def test_excel_csv_with_bom(admin_client):
+    content = '\ufeffkey\r\nPFIZER-AAAA-BBBB-CCCC-0001\r\nPFIZER-AAAA-BBBB-CCCC-0002\r\n'.encode('utf-8')
+    result = admin_client.post('/admin/bulk_add_licenses',
+                               data={'file': (io.BytesIO(content), 'keys.csv')},
+                               content_type='multipart/form-data').get_json()
+
+    assert result['success'] is True, result
+    assert result['added'] == 2
+    assert result['errors_total'] == 0
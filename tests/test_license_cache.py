@@ -0,0 +1,59 @@
+import pytest
+
+import app as app_module
+
+KEY = 'PFIZER-AAAA-BBBB-CCCC-DDDD'
+
+
+def set_license(app, **values):
+    """Изменение в обход этого процесса - как в другом воркере, без сброса кэша"""
+    with app.app_context():
+        app_module.db.session.execute(
+            app_module.db.update(app_module.License).where(app_module.License.key == KEY).values(**values)
+        )
+        app_module.db.session.commit()
+
+
+def validate(client, hwid):
+    return client.post('/license', json={'action': 'validate', 'key': KEY, 'hwid': hwid}).get_json()
+
+
+def validate_batch(client, hwid):
+    return client.post('/license/batch', json={'items': [{'key': KEY, 'hwid': hwid}]}).get_json()['results'][0]
+
+
+@pytest.mark.parametrize('check', [validate, validate_batch])
+def test_activation_in_other_worker_is_seen(app, client, license_factory, check):
+    license_factory(hwid=None)
+    assert check(client, 'HWID-1')['error'] == 'License not activated'
+
+    set_license(app, hwid='HWID-1')
+    assert check(client, 'HWID-1')['valid'] is True
+
+
+@pytest.mark.parametrize('check', [validate, validate_batch])
+def test_approved_device_in_other_worker_is_seen(app, client, license_factory, check):
+    license_factory(hwid='HWID-1')
+    assert check(client, 'HWID-1')['valid'] is True
+    assert check(client, 'HWID-2')['error'] == 'License not valid for this device'
+
+    set_license(app, hwid='HWID-2')
+    assert check(client, 'HWID-2')['valid'] is True
+
+
+@pytest.mark.parametrize('check', [validate, validate_batch])
+def test_reenabled_license_in_other_worker_is_seen(app, client, license_factory, check):
+    license_factory(hwid='HWID-1')
+    set_license(app, is_active=False)
+    assert check(client, 'HWID-1')['error'] == 'License is deactivated'
+
+    set_license(app, is_active=True)
+    assert check(client, 'HWID-1')['valid'] is True
+
+
+def test_valid_state_is_served_from_cache(client, license_factory):
+    license_factory(hwid='HWID-1')
+    assert validate(client, 'HWID-1')['valid'] is True
+
+    with app_module.assert_max_queries(0):
+        assert validate(client, 'HWID-1')['valid'] is True
@@ -0,0 +1,39 @@
+import pytest
+
+import app as app_module
+
+KEY = 'PFIZER-AAAA-BBBB-CCCC-DDDD'
+
+
+def validate(client):
+    return client.post('/license', json={'action': 'validate', 'key': KEY, 'hwid': 'HWID-1'}).get_json()
+
+
+def test_validate_query_budget(client, license_factory):
+    license_factory()
+
+    # Промах кэша - один SELECT колонок лицензии
+    with app_module.assert_max_queries(1):
+        assert validate(client)['valid'] is True
+
+    # Попадание в кэш - без обращений к базе
+    with app_module.assert_max_queries(0):
+        assert validate(client)['valid'] is True
+
+
+def test_batch_query_budget(client, license_factory):
+    keys = [f'PFIZER-AAAA-BBBB-CCCC-{i:04d}' for i in range(20)]
+    for key in keys:
+        license_factory(key=key)
+
+    with app_module.assert_max_queries(1):
+        result = client.post('/license/batch', json={'items': [{'key': key, 'hwid': 'HWID-1'} for key in keys]})
+    assert all(item['valid'] for item in result.get_json()['results'])
+
+
+def test_assert_max_queries_reports_statements(app):
+    with app.app_context():
+        with pytest.raises(AssertionError, match='2 queries executed, expected at most 1'):
+            with app_module.assert_max_queries(1):
+                app_module.db.session.execute(app_module.db.text('SELECT 1'))
+                app_module.db.session.execute(app_module.db.text('SELECT 2'))
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+import app as app_module
+
+KEY = 'PFIZER-AAAA-BBBB-CCCC-DDDD'
+
+
+def validate(client, hwid='HWID-1'):
+    return client.post('/license', json={'action': 'validate', 'key': KEY, 'hwid': hwid}).get_json()
+
+
+def verify(client, token, hwid='HWID-1'):
+    return client.post('/license/token/verify', json={'token': token, 'hwid': hwid}).get_json()
+
+
+def test_token_secret_is_not_session_key():
+    assert app_module.LICENSE_TOKEN_SECRET != app_module.app.config['SECRET_KEY'].encode()
+
+
+def test_issued_at_has_millisecond_precision():
+    token = app_module.issue_license_token(KEY, 'HWID-1', issued_at=1700000000.1239)
+    payload = app_module.verify_license_token(token, 'HWID-1', now=1700000001)
+    assert payload['i'] == 1700000000.123
+
+
+@pytest.mark.parametrize('token', ['é.é', 'abc', 'a.b.c', '.', None, 123])
+def test_malformed_token_is_rejected(client, token):
+    assert app_module.verify_license_token(token) is None
+    if token:
+        assert verify(client, token) == {'valid': False, 'error': 'Invalid or expired token'}
+
+
+def test_token_valid_after_revoke_and_reenable(client, admin_client, license_factory):
+    license_id = license_factory()
+    old_token = validate(client)['token']
+
+    # Выключение и включение в ту же секунду, что и выдача новых токенов
+    for _ in range(2):
+        assert admin_client.post(f'/admin/toggle_license/{license_id}').get_json()['success']
+
+    assert verify(client, old_token)['valid'] is False
+    for _ in range(20):
+        result = validate(client)
+        assert result['valid'] is True
+        assert verify(client, result['token'])['valid'] is True
+
+
+def test_cached_state_does_not_outlive_revocation(app, client, license_factory):
+    license_factory()
+    assert validate(client)['valid'] is True
+
+    # Отзыв в другом воркере: кэш этого процесса о нем не знает
+    with app.app_context():
+        app_module.revoke_license_tokens([KEY])
+        app_module.db.session.commit()
+
+    result = validate(client)
+    assert result['valid'] is True
+    assert verify(client, result['token']) == {'valid': False, 'error': 'Token has been revoked'}
+
+
+def test_fresh_state_after_revocation_issues_valid_token(app, client, license_factory):
+    license_factory()
+    with app.app_context():
+        app_module.db.session.add(app_module.TokenRevocation(key=KEY, revoked_at=datetime.utcnow()))
+        app_module.db.session.commit()
+
+    result = validate(client)
+    assert verify(client, result['token'])['valid'] is True